@@ -1,9 +1,19 @@
 import sqlite3
 import json
 import re
-from flask import Flask, send_from_directory, g, request, jsonify
+import hashlib
+import zlib
+import random
+import tarfile
+import posixpath
+from flask import Flask, send_from_directory, g, request, jsonify, Response
 from datetime import datetime, timezone
 import os
+import threading
+import time
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from werkzeug.exceptions import NotFound # Import NotFound specifically
 
 app = Flask(__name__)
@@ -35,123 +45,677 @@ def close_db(e=None):
     if db is not None:
         db.close()
 
-def scan_pdfs_and_populate_db():
+# Threads currently handling a request that may write (anything but GET, HEAD and OPTIONS),
+# except while they wait for or run a scan themselves.
+# SQLite's busy handler only retries now and then, so a writer waiting on a scan's write lock
+# could miss every gap between the scan's batches; the scan uses this to let such writers in.
+_write_request_threads = set()
+_write_request_threads_lock = threading.Lock()
+
+def track_write_request_start():
+    """Registers the current thread as handling a write request."""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        with _write_request_threads_lock:
+            _write_request_threads.add(threading.get_ident())
+
+def track_write_request_end(e=None):
+    """Unregisters the current thread once its request is done."""
+    with _write_request_threads_lock:
+        _write_request_threads.discard(threading.get_ident())
+
+def wait_for_write_requests():
     """
-    Scans the PDF_STORAGE_PATH_VAR, clears existing library data,
-    and populates the LibraryItem table in the database.
-    This reconstructs the folder structure and PDF entries.
-    This function will only proceed if PDF_STORAGE_PATH_VAR is a valid directory.
+    Called by the scan between batches, with no transaction open: waits (at most
+    SCAN_MAX_YIELD_SECONDS) until write requests on other threads have finished.
     """
-    db = get_db()
-    cursor = db.cursor()
+    deadline = time.monotonic() + SCAN_MAX_YIELD_SECONDS
+    own_thread = threading.get_ident()
+    while time.monotonic() < deadline:
+        with _write_request_threads_lock:
+            if not _write_request_threads - {own_thread}:
+                return
+        time.sleep(0.005)
+
+# Columns every LibraryItem table has. Shadow tables built by the scanner use the same definition.
+LIBRARY_ITEM_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL, -- 'folder' or 'pdf'
+        parent_id INTEGER,
+        pdf_url TEXT, -- Now stores relative paths like 'Classical/Beethoven.pdf'
+        date_created TEXT,
+        date_last_played TEXT,
+        title TEXT, composer TEXT, genre TEXT, tag TEXT, label TEXT, rating TEXT,
+        difficulty TEXT, playtime TEXT, key TEXT, time TEXT,
+        path TEXT, -- '/'-separated location relative to the storage root ('' for Root)
+        size INTEGER, -- PDF file size in bytes
+        FOREIGN KEY (parent_id) REFERENCES {table} (id)
+    )
+'''
+
+# User-editable metadata columns of LibraryItem
+METADATA_COLUMNS = ['title', 'composer', 'genre', 'tag', 'label', 'rating', 'difficulty', 'playtime', 'key', 'time']
+
+# All LibraryItem columns, in LIBRARY_ITEM_TABLE_SQL order
+LIBRARY_ITEM_COLUMNS = ['id', 'name', 'type', 'parent_id', 'pdf_url', 'date_created', 'date_last_played'] + METADATA_COLUMNS + ['path', 'size']
+
+# Indexes on LibraryItem, as {base_name: column}
+LIBRARY_ITEM_INDEXES = {'idx_LibraryItem_path': 'path', 'idx_LibraryItem_parent_id': 'parent_id'}
+
+# A full scan is built into this table and then swapped in for LibraryItem
+SHADOW_LIBRARY_TABLE = 'LibraryItem_shadow'
+
+# While a scan runs, this trigger on LibraryItem records the ids of items whose metadata or
+# play date is edited in this table, so the swap re-copies just those rows into the shadow table.
+SCAN_EDITS_TABLE = 'LibraryItem_scan_edits'
+SCAN_EDITS_TRIGGER = 'LibraryItem_track_scan_edits'
+
+# The swap renames the previous LibraryItem to this table rather than dropping it, because dropping
+# a large table holds the write lock until every page is freed; it is emptied in batches afterwards.
+RETIRED_LIBRARY_TABLE = 'LibraryItem_retired'
+
+# The shadow table is committed in batches of this many rows, or after SCAN_MAX_WRITE_LOCK_SECONDS,
+# whichever comes first, so other writers only ever wait a moment for the scan's write lock.
+# Pending rows are also committed before the scan waits on a directory listing.
+SCAN_COMMIT_BATCH_SIZE = 5000
+SCAN_MAX_WRITE_LOCK_SECONDS = 0.1
+
+# Between batches the scan gives way to write requests in progress (see wait_for_write_requests),
+# but never for longer than this per batch, so a steady stream of edits cannot stall a scan.
+SCAN_MAX_YIELD_SECONDS = 2.0
+
+# Only one scan may build the shadow table at a time. Operations that change the library's
+# structure (renames, moves, root removal) hold it too, so they never run during a scan.
+scan_lock = threading.Lock()
+
+# True while a scan holds scan_lock, so a structural change turned away can say why
+scan_in_progress = False
+
+# How long a structural change waits for another one (not a scan) to release scan_lock
+STRUCTURE_LOCK_WAIT_SECONDS = 10.0
+
+def requires_scan_lock(view):
+    """
+    Decorator for endpoints that rename, move or remove library items. The scan copies
+    items by path, so such changes made mid-scan would be lost in the swap; while a
+    scan is running these endpoints answer 409 instead of waiting for it. Behind another
+    rename or move they wait up to STRUCTURE_LOCK_WAIT_SECONDS for it to finish.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Not counted as a writer while queued, so a scan starting meanwhile does not wait on us
+        track_write_request_end()
+        deadline = time.monotonic() + STRUCTURE_LOCK_WAIT_SECONDS
+        while not scan_lock.acquire(timeout=0.05):
+            if scan_in_progress:
+                return jsonify({"error": "A library scan is in progress. Try again when it has finished."}), 409
+            if time.monotonic() >= deadline:
+                return jsonify({"error": "Another rename or move is still in progress. Try again shortly."}), 409
+        try:
+            track_write_request_start()
+            return view(*args, **kwargs)
+        finally:
+            scan_lock.release()
+    return wrapper
+
+@contextlib.contextmanager
+def running_scan():
+    """Holds scan_lock for a scan, flagging it as one for requires_scan_lock."""
+    global scan_in_progress
+    with scan_lock:
+        scan_in_progress = True
+        try:
+            yield
+        finally:
+            scan_in_progress = False
 
-    # --- Preserve playlist associations ---
-    print("Backing up playlist associations...")
-    cursor.execute("""
-        SELECT ps.playlist_id, li.pdf_url, ps.order_index
-        FROM PlaylistSong ps
-        JOIN LibraryItem li ON ps.library_item_id = li.id
-    """)
-    playlist_backup = [dict(row) for row in cursor.fetchall()]
-    print(f"Backed up {len(playlist_backup)} playlist entries.")
+def create_library_item_indexes(cursor, table, suffix=''):
+    """
+    Creates the LibraryItem indexes on the given table.
+    Index names cannot be changed when a table is renamed, so the scanner builds the
+    shadow table's indexes under the suffix the live table is not currently using.
+    """
+    for index_name, column in LIBRARY_ITEM_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name}{suffix} ON {table} ({column})")
 
-    # Clear existing library items and playlist songs before scanning
-    # This is crucial to refresh the library from the file system
-    cursor.execute("DELETE FROM PlaylistSong") # Must delete playlist songs first due to FK constraint
-    cursor.execute("DELETE FROM LibraryItem")
-    db.commit()
-    print("Cleared existing library and playlist data for refresh.")
-
-    # Only proceed with scanning if PDF_STORAGE_PATH_VAR is set and is a valid directory
-    if not PDF_STORAGE_PATH_VAR or not os.path.isdir(PDF_STORAGE_PATH_VAR):
-        print(f"Warning: PDF_STORAGE_PATH_VAR is not set or is not a valid directory ('{PDF_STORAGE_PATH_VAR}'). Skipping PDF scan.")
-        # Ensure 'Root' folder exists even if no PDFs are scanned
-        cursor.execute("INSERT OR IGNORE INTO LibraryItem (id, name, type, parent_id, pdf_url, date_created, date_last_played) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                       (1, "Root", "folder", None, None, datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), None))
-        db.commit()
-        return
+def get_library_index_suffix(cursor):
+    """
+    Returns the index name suffix ('' or '_alt') currently used by the live LibraryItem table,
+    or None if it has no path index yet.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'LibraryItem'")
+    index_names = {row['name'] for row in cursor.fetchall()}
+    for suffix in ('', '_alt'):
+        if f"idx_LibraryItem_path{suffix}" in index_names:
+            return suffix
+    return None
 
-    print(f"Scanning PDF_STORAGE_PATH_VAR: {PDF_STORAGE_PATH_VAR}")
+# --- Storage Roots ---
 
-    # Ensure the conceptual 'Root' folder entry exists for hierarchical structure
-    cursor.execute("INSERT OR IGNORE INTO LibraryItem (id, name, type, parent_id, pdf_url, date_created, date_last_played) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                   (1, "Root", "folder", None, None, datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), None))
-    root_db_id = 1 # The ID for the Root folder is always 1
+# The root configured through 'pdf_storage_path' (PDF_STORAGE_PATH_VAR). Its contents sit directly
+# under Root; every other root appears as a top-level folder named after the root.
+PRIMARY_ROOT_NAME = 'default'
 
-    # Recursive function to build the nested structure
-    def insert_scanned_item(abs_path, relative_path, parent_db_id):
-        item_name = os.path.basename(abs_path)
-        item_type = "folder" if os.path.isdir(abs_path) else "pdf"
-        
-        # Only process PDF files (ending with .pdf) and folders
-        if item_type == "pdf" and not item_name.lower().endswith('.pdf'):
-            return # Skip non-PDF files
+# Settings every storage root has, with their defaults.
+# scan_interval: seconds between automatic scans of the root (0 = only when requested)
+# scan_concurrency: how many of the root's directories are listed in parallel during a scan
+# check_timeout: seconds the availability check may take before the root counts as offline
+STORAGE_ROOT_DEFAULTS = {'scan_interval': 0, 'scan_concurrency': 1, 'check_timeout': 2.0}
 
-        date_created = datetime.fromtimestamp(os.path.getctime(abs_path), tz=timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
-        date_last_played = datetime.fromtimestamp(os.path.getmtime(abs_path), tz=timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z') # Using modification time as last played
+# Port the development server listens on, and how long the deferred startup work waits for it
+SERVER_PORT = 5000
+SERVER_START_TIMEOUT = 30
 
-        cursor.execute("""
-            INSERT INTO LibraryItem (name, type, parent_id, pdf_url, date_created, date_last_played)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (item_name, item_type, parent_db_id,
-              relative_path if item_type == "pdf" else None, date_created, date_last_played))
-        item_id = cursor.lastrowid
+# How often the background scheduler refreshes root health and runs due scans, in seconds
+SCAN_SCHEDULER_TICK = 30
 
-        # If it's a folder, recursively scan its contents
-        if item_type == "folder":
-            for entry_name in os.listdir(abs_path):
-                entry_abs_path = os.path.join(abs_path, entry_name)
-                # Build relative path correctly for sub-items
-                entry_relative_path = os.path.join(relative_path, entry_name) if relative_path else entry_name
-                insert_scanned_item(entry_abs_path, entry_relative_path, item_id)
-    
-    # Start scanning from the PDF_STORAGE_PATH_VAR, linking its direct contents to the 'Root' folder in the database
-    for entry_name in os.listdir(PDF_STORAGE_PATH_VAR):
-        entry_abs_path = os.path.join(PDF_STORAGE_PATH_VAR, entry_name)
-        # Initial relative path for top-level items is just their name
-        insert_scanned_item(entry_abs_path, entry_name, root_db_id)
-    
-    db.commit()
-    print("Library scanned and database populated.")
+# Configured storage roots: dicts with 'name', 'path' and the STORAGE_ROOT_DEFAULTS keys.
+# The primary root is always first.
+STORAGE_ROOTS = []
 
-    # --- Restore playlist associations ---
-    print("Restoring playlist associations...")
-    restored_count = 0
-    if playlist_backup:
-        # Create a map of pdf_url to new id for faster lookups
-        cursor.execute("SELECT id, pdf_url FROM LibraryItem WHERE type = 'pdf'")
-        new_id_map = {row['pdf_url']: row['id'] for row in cursor.fetchall()}
+# Precomputed lookup from mount folder ('' for the primary root) to (root name, absolute root path).
+# Rebuilt only when the roots change, so serving a PDF does no per-request path normalisation.
+ROOT_LOOKUP = {}
 
-        for entry in playlist_backup:
-            playlist_id = entry['playlist_id']
-            pdf_url = entry['pdf_url']
-            order_index = entry['order_index']
+# Latest known state per root name: {'online', 'error', 'checked_at', 'last_scan'}
+ROOT_STATUS = {}
 
-            new_song_id = new_id_map.get(pdf_url)
+# Availability checks run on these workers, so a hung network mount only ever blocks a worker thread.
+# A check that is still stuck is reused rather than resubmitted, so hung checks never pile up.
+_root_check_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='root-check')
+_pending_root_checks = {}
 
-            if new_song_id:
-                try:
-                    cursor.execute(
-                        "INSERT INTO PlaylistSong (playlist_id, library_item_id, order_index) VALUES (?, ?, ?)",
-                        (playlist_id, new_song_id, order_index)
-                    )
-                    restored_count += 1
-                except sqlite3.IntegrityError:
-                    print(f"Warning: Could not restore playlist entry for PDF '{pdf_url}' - possibly a duplicate.")
-            else:
-                print(f"Warning: PDF '{pdf_url}' from a playlist was not found after rescan. It will be removed from the playlist.")
-    
+def get_root_mount(root):
+    """
+    Returns the top-level folder a root's contents appear under ('' for the primary root).
+    """
+    return '' if root['name'] == PRIMARY_ROOT_NAME else root['name']
+
+def normalize_storage_root(data, existing=None):
+    """
+    Validates storage root settings from a request or the config, filling in defaults
+    (or the existing root's values). Raises ValueError with a user-facing message.
+    """
+    root = dict(STORAGE_ROOT_DEFAULTS)
+    if existing:
+        root.update(existing)
+    root.update({k: v for k, v in data.items() if k in ('name', 'path') or k in STORAGE_ROOT_DEFAULTS})
+
+    name = root.get('name')
+    if not name or not isinstance(name, str) or name in ('.', '..') or '/' in name or os.sep in name:
+        raise ValueError("Root name is required and cannot contain path separators.")
+    try:
+        root['scan_interval'] = int(root['scan_interval'])
+        root['scan_concurrency'] = int(root['scan_concurrency'])
+        root['check_timeout'] = float(root['check_timeout'])
+    except (TypeError, ValueError):
+        raise ValueError("scan_interval, scan_concurrency and check_timeout must be numbers.")
+    if root['scan_interval'] < 0 or root['scan_concurrency'] < 1 or root['check_timeout'] <= 0:
+        raise ValueError("scan_interval must be >= 0, scan_concurrency >= 1 and check_timeout > 0.")
+    if root.get('path'):
+        root['path'] = os.path.normpath(root['path'])
+    return root
+
+def set_storage_roots(roots):
+    """
+    Installs a new list of storage roots and rebuilds the cached root lookup.
+    Keeps PDF_STORAGE_PATH_VAR pointing at the primary root.
+    """
+    global STORAGE_ROOTS, ROOT_LOOKUP, PDF_STORAGE_PATH_VAR
+    previous_paths = {root['name']: root.get('path') for root in STORAGE_ROOTS}
+    lookup = {}
+    for root in roots:
+        if root.get('path'):
+            lookup[get_root_mount(root)] = (root['name'], os.path.abspath(root['path']))
+        # A root that moved needs a fresh availability check
+        if previous_paths.get(root['name']) != root.get('path'):
+            ROOT_STATUS.pop(root['name'], None)
+    STORAGE_ROOTS = roots
+    ROOT_LOOKUP = lookup
+    PDF_STORAGE_PATH_VAR = roots[0].get('path') if roots else None
+
+def set_primary_storage_path(path):
+    """
+    Points the primary root (PDF_STORAGE_PATH_VAR) at a new path, keeping its settings and the other roots.
+    """
+    primary = dict(STORAGE_ROOTS[0]) if STORAGE_ROOTS else {'name': PRIMARY_ROOT_NAME}
+    primary['path'] = path
+    set_storage_roots([normalize_storage_root(primary)] + STORAGE_ROOTS[1:])
+
+def load_storage_roots(cursor):
+    """
+    Loads the storage roots from the Config table.
+    The primary root's path always comes from 'pdf_storage_path'; the other roots and
+    every root's settings come from the JSON list under 'storage_roots'.
+    """
+    cursor.execute("SELECT key, value FROM Config WHERE key IN ('pdf_storage_path', 'storage_roots')")
+    config = {row['key']: row['value'] for row in cursor.fetchall()}
+
+    stored_roots = []
+    if config.get('storage_roots'):
+        try:
+            stored_roots = json.loads(config['storage_roots'])
+        except ValueError:
+            print("Warning: 'storage_roots' in config is not valid JSON. Ignoring it.")
+
+    primary = {'name': PRIMARY_ROOT_NAME}
+    roots = []
+    for stored in stored_roots:
+        try:
+            root = normalize_storage_root(stored)
+        except ValueError as e:
+            print(f"Warning: ignoring invalid storage root {stored!r}: {e}")
+            continue
+        if root['name'] == PRIMARY_ROOT_NAME:
+            primary = root
+        else:
+            roots.append(root)
+    primary['path'] = config.get('pdf_storage_path')
+    set_storage_roots([normalize_storage_root(primary)] + roots)
+
+def save_storage_roots(cursor):
+    """
+    Writes the storage roots to the Config table (the caller commits).
+    """
+    cursor.execute("INSERT OR REPLACE INTO Config (key, value) VALUES (?, ?)", ('storage_roots', json.dumps(STORAGE_ROOTS)))
+    if PDF_STORAGE_PATH_VAR:
+        cursor.execute("INSERT OR REPLACE INTO Config (key, value) VALUES (?, ?)", ('pdf_storage_path', PDF_STORAGE_PATH_VAR))
+
+def find_storage_root(name):
+    """Returns the configured root with this name, or None."""
+    return next((root for root in STORAGE_ROOTS if root['name'] == name), None)
+
+def resolve_root(relative_path):
+    """
+    Maps a library-relative path (pdf_url or path) to (root name, absolute root path, path inside the root)
+    using the precomputed ROOT_LOOKUP. The absolute root path is None if the root is not configured.
+    """
+    head, separator, rest = relative_path.replace(os.sep, '/').partition('/')
+    if head and head in ROOT_LOOKUP:
+        root_name, root_abs_path = ROOT_LOOKUP[head]
+        return root_name, root_abs_path, rest
+    root_name, root_abs_path = ROOT_LOOKUP.get('', (PRIMARY_ROOT_NAME, None))
+    return root_name, root_abs_path, relative_path.replace(os.sep, '/')
+
+def get_abs_path_for(item_path):
+    """
+    Converts a materialized '/'-separated library path into an absolute file system path,
+    or None if the root it belongs to is not configured.
+    """
+    _, root_abs_path, inner_path = resolve_root(item_path)
+    if root_abs_path is None:
+        return None
+    return os.path.join(root_abs_path, *inner_path.split('/')) if inner_path else root_abs_path
+
+def _probe_root_path(path):
+    """Opens the root directory; raises OSError if it is missing or unreadable."""
+    with os.scandir(path) as entries:
+        next(entries, None)
+    return True
+
+def check_storage_roots(roots):
+    """
+    Checks the availability of the given roots concurrently, each bounded by its own
+    check_timeout, and records the outcome in ROOT_STATUS. Returns the set of online root names.
+    """
+    started = time.monotonic()
+    checks = []
+    for root in roots:
+        if not root.get('path'):
+            ROOT_STATUS.setdefault(root['name'], {}).update(online=False, error="Path not configured.")
+            continue
+        future = _pending_root_checks.get(root['name'])
+        if future is None or future.done():
+            future = _root_check_executor.submit(_probe_root_path, root['path'])
+            _pending_root_checks[root['name']] = future
+        checks.append((root, future))
+
+    online = set()
+    for root, future in checks:
+        remaining = max(0.0, started + root['check_timeout'] - time.monotonic())
+        error = None
+        try:
+            future.result(timeout=remaining)
+            online.add(root['name'])
+        except FutureTimeoutError:
+            error = f"No response within {root['check_timeout']} seconds."
+        except OSError as e:
+            error = str(e)
+        ROOT_STATUS.setdefault(root['name'], {}).update(
+            online=error is None, error=error,
+            checked_at=datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'))
+        if error:
+            print(f"Warning: storage root '{root['name']}' is offline: {error}")
+    return online
+
+def is_root_online(root_name):
+    """Last known availability of a root; roots that were never checked count as online."""
+    return ROOT_STATUS.get(root_name, {}).get('online', True)
+
+def scan_pdfs_and_populate_db(root_names=None):
+    """
+    Scans the storage roots and rebuilds the LibraryItem table from them.
+    This reconstructs the folder structure and PDF entries.
+
+    root_names limits which roots are walked (default: all). Roots that are not walked, or
+    that fail their availability check, keep their current items, so an offline share is
+    skipped without erasing anything. Each root is listed with up to its scan_concurrency
+    directories in parallel.
+
+    The scan is built into a shadow table while readers keep using the current library,
+    then swapped in with one short transaction (see swap_in_shadow_library), so a failed
+    or interrupted scan leaves the existing library and playlists untouched.
+    Items found at the same path as before keep their id, metadata and last played date.
+    """
+    # A request that triggers a scan is not an edit the running scan should give way to:
+    # while it queues for scan_lock, and while it scans, its thread is not counted as a writer.
+    track_write_request_end()
+    with running_scan():
+        requested_roots = [root for root in STORAGE_ROOTS if root_names is None or root['name'] in root_names]
+        online = check_storage_roots([root for root in requested_roots if root.get('path')])
+        # An unconfigured root has nothing to walk; it contributes no items
+        walk_names = {root['name'] for root in requested_roots if root['name'] in online or not root.get('path')}
+
+        db = get_db()
+        cursor = db.cursor()
+
+        # Discard anything left behind by an interrupted scan; the live tables were never touched
+        cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_LIBRARY_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {RETIRED_LIBRARY_TABLE}")
+        cursor.execute(LIBRARY_ITEM_TABLE_SQL.format(table=SHADOW_LIBRARY_TABLE))
+        # Start new ids above every id the live table has handed out, so preserved ids never collide
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (SHADOW_LIBRARY_TABLE,))
+        cursor.execute("""
+            INSERT INTO sqlite_sequence (name, seq)
+            VALUES (?, MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'LibraryItem'), 0),
+                           COALESCE((SELECT MAX(id) FROM LibraryItem), 0)))
+        """, (SHADOW_LIBRARY_TABLE,))
+        # Edits committed from here on are recorded; earlier ones are seen by the copy itself
+        start_tracking_scan_edits(cursor)
+        db.commit()
+
+        try:
+            populate_shadow_library(db, walk_names)
+            swap_in_shadow_library(db)
+        except Exception:
+            db.rollback()
+            cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_LIBRARY_TABLE}")
+            stop_tracking_scan_edits(cursor)
+            db.commit()
+            raise
+        drop_retired_library(db)
+
+        for root_name in walk_names:
+            ROOT_STATUS.setdefault(root_name, {})['last_scan'] = time.time()
+
+def start_tracking_scan_edits(cursor):
+    """Creates the trigger that records items edited during the scan. The caller commits."""
+    carried_columns = ['date_last_played'] + METADATA_COLUMNS
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {SCAN_EDITS_TABLE} (id INTEGER PRIMARY KEY)")
+    stop_tracking_scan_edits(cursor)
+    cursor.execute(f"""
+        CREATE TRIGGER {SCAN_EDITS_TRIGGER} AFTER UPDATE OF {', '.join(carried_columns)} ON LibraryItem
+        BEGIN
+            INSERT OR IGNORE INTO {SCAN_EDITS_TABLE} (id) VALUES (NEW.id);
+        END
+    """)
+
+def stop_tracking_scan_edits(cursor):
+    """Removes the edit-tracking trigger (if any) and forgets the recorded ids. The caller commits."""
+    cursor.execute(f"DROP TRIGGER IF EXISTS {SCAN_EDITS_TRIGGER}")
+    cursor.execute(f"DELETE FROM {SCAN_EDITS_TABLE}")
+
+def list_scan_directory(abs_dir):
+    """
+    Lists one directory for the scanner: returns (name, is_folder, stat_result) for
+    every sub-folder and PDF file. Runs on the scan worker threads.
+    """
+    entries = []
+    with os.scandir(abs_dir) as directory:
+        for entry in directory:
+            is_folder = entry.is_dir()
+            # Only process PDF files (ending with .pdf) and folders
+            if not is_folder and not entry.name.lower().endswith('.pdf'):
+                continue # Skip non-PDF files
+            entries.append((entry.name, is_folder, entry.stat()))
+    return entries
+
+def populate_shadow_library(db, walk_names):
+    """
+    Fills the shadow table: walks the roots named in walk_names and copies the current
+    items of every other root, then builds the shadow table's indexes.
+    """
+    cursor = db.cursor()
+    carried_columns = ['date_last_played'] + METADATA_COLUMNS
+    carried_select = ', '.join(carried_columns)
+    insert_columns = ['id', 'name', 'type', 'parent_id', 'pdf_url', 'date_created', 'path', 'size'] + carried_columns
+    insert_sql = f"INSERT INTO {SHADOW_LIBRARY_TABLE} ({', '.join(insert_columns)}) VALUES ({', '.join('?' * len(insert_columns))})"
+    pending_rows = 0 # Rows inserted since the last commit
+    first_pending_at = None # When the oldest uncommitted row was written
+
+    def commit_pending_rows():
+        nonlocal pending_rows, first_pending_at
+        if pending_rows:
+            db.commit()
+            wait_for_write_requests()
+        pending_rows = 0
+        first_pending_at = None
+
+    # The conceptual 'Root' folder entry for the hierarchical structure; its ID is always 1
+    cursor.execute(f"INSERT INTO {SHADOW_LIBRARY_TABLE} (id, name, type, parent_id, pdf_url, date_created, date_last_played, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (1, "Root", "folder", None, None, datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), None, ''))
+    root_db_id = 1
+
+    def insert_scanned_item(item_name, is_folder, stat_result, item_path, parent_db_id):
+        nonlocal pending_rows, first_pending_at
+        item_type = "folder" if is_folder else "pdf"
+        date_created = datetime.fromtimestamp(stat_result.st_ctime, tz=timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+        date_last_played = datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z') # Using modification time as last played
+
+        # Reuse the id and user data of the item previously stored at this path
+        cursor.execute(f"SELECT id, {carried_select} FROM LibraryItem WHERE path = ? AND type = ?", (item_path, item_type))
+        previous = cursor.fetchone()
+        if previous:
+            item_id = previous['id']
+            carried_values = [previous[col] or (date_last_played if col == 'date_last_played' else None) for col in carried_columns]
+        else:
+            item_id = None
+            carried_values = [date_last_played] + [None] * len(METADATA_COLUMNS)
+
+        cursor.execute(insert_sql, [item_id, item_name, item_type, parent_db_id,
+                                    item_path.replace('/', os.sep) if item_type == "pdf" else None, date_created, item_path,
+                                    stat_result.st_size if item_type == "pdf" else None] + carried_values)
+
+        item_id = cursor.lastrowid
+        pending_rows += 1
+        if first_pending_at is None:
+            first_pending_at = time.monotonic()
+        if pending_rows >= SCAN_COMMIT_BATCH_SIZE or time.monotonic() - first_pending_at >= SCAN_MAX_WRITE_LOCK_SECONDS:
+            commit_pending_rows()
+        return item_id
+
+    secondary_mounts = {get_root_mount(root) for root in STORAGE_ROOTS if root['name'] != PRIMARY_ROOT_NAME}
+
+    for root in STORAGE_ROOTS:
+        mount = get_root_mount(root)
+        if root['name'] not in walk_names:
+            copied_count = copy_root_items_to_shadow(cursor, mount, secondary_mounts)
+            print(f"Kept {copied_count} existing items of storage root '{root['name']}'.")
+            continue
+        if not root.get('path'):
+            print(f"Warning: storage root '{root['name']}' has no path configured. Skipping PDF scan.")
+            continue
+
+        print(f"Scanning storage root '{root['name']}': {root['path']}")
+        if mount:
+            # Secondary roots hang off Root as a folder named after the root
+            parent_id = insert_scanned_item(mount, True, os.stat(root['path']), mount, root_db_id)
+        else:
+            parent_id = root_db_id
+
+        # Walk breadth-first so parents are always inserted before their children. The directories
+        # of one level are listed in parallel; all database writes stay on this thread.
+        level = [(root['path'], parent_id, mount)]
+        with ThreadPoolExecutor(max_workers=root['scan_concurrency']) as pool:
+            while level:
+                listings = [pool.submit(list_scan_directory, abs_dir) for abs_dir, _, _ in level]
+                next_level = []
+                for (abs_dir, dir_id, dir_path), listing in zip(level, listings):
+                    # Never hold the write lock while waiting on the file system
+                    if not listing.done():
+                        commit_pending_rows()
+                    entries = listing.result()
+                    for entry_name, is_folder, stat_result in entries:
+                        if not dir_path and entry_name in secondary_mounts:
+                            print(f"Warning: '{entry_name}' in the primary root is hidden by the storage root of the same name.")
+                            continue
+                        entry_path = f"{dir_path}/{entry_name}" if dir_path else entry_name
+                        entry_id = insert_scanned_item(entry_name, is_folder, stat_result, entry_path, dir_id)
+                        if is_folder:
+                            next_level.append((os.path.join(abs_dir, entry_name), entry_id, entry_path))
+                level = next_level
+
+    # Build the shadow's indexes now, so the swap itself does no bulk work
+    live_suffix = get_library_index_suffix(cursor)
+    create_library_item_indexes(cursor, SHADOW_LIBRARY_TABLE, '_alt' if live_suffix == '' else '')
     db.commit()
-    print(f"Restored {restored_count} playlist entries.")
+    print("Library scanned into shadow table.")
 
-def init_db():
+def copy_root_items_to_shadow(cursor, mount, secondary_mounts):
     """
-    Initializes the database: creates tables and loads initial configuration.
+    Copies the current items of one root from LibraryItem into the shadow table unchanged.
+    A secondary root is its mount folder's subtree; the primary root is everything else below Root.
+    """
+    columns = ', '.join(LIBRARY_ITEM_COLUMNS)
+    sql_query = f"INSERT INTO {SHADOW_LIBRARY_TABLE} ({columns}) SELECT {columns} FROM LibraryItem WHERE "
+    if mount:
+        lower, upper = get_subtree_bounds(mount)
+        cursor.execute(sql_query + "(path = ? OR (path > ? AND path < ?))", (mount, lower, upper))
+    else:
+        conditions = ["parent_id IS NOT NULL"]
+        values = []
+        for secondary_mount in secondary_mounts:
+            lower, upper = get_subtree_bounds(secondary_mount)
+            conditions.append("NOT (path = ? OR (path > ? AND path < ?))")
+            values.extend([secondary_mount, lower, upper])
+        cursor.execute(sql_query + " AND ".join(conditions), tuple(values))
+    return cursor.rowcount
+
+def swap_in_shadow_library(db):
+    """
+    Replaces LibraryItem with the freshly built shadow table in one short transaction.
+    Playlist memberships are remapped by path in SQL; entries whose PDF no longer
+    exists are removed. Readers see either the old library or the new one, never a mix.
     """
-    global PDF_STORAGE_PATH_VAR # Declare intent to modify global variable
-    db = get_db()
     cursor = db.cursor()
+    # Subquery mapping a live PlaylistSong entry to the shadow item at the same path
+    new_id_for_entry = f"""
+        SELECT s.id FROM LibraryItem o
+        JOIN {SHADOW_LIBRARY_TABLE} s ON s.path = o.path AND s.type = 'pdf'
+        WHERE o.id = PlaylistSong.library_item_id
+    """
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        # Metadata and play dates may have been edited after the scan copied an item; take the
+        # live values of the recorded items again now that no other writer can get in between
+        # (an item that was never played keeps the date the scan gave it, as in insert_scanned_item)
+        cursor.execute(f"""
+            UPDATE {SHADOW_LIBRARY_TABLE}
+            SET (date_last_played, {', '.join(METADATA_COLUMNS)}) = (
+                SELECT COALESCE(o.date_last_played, {SHADOW_LIBRARY_TABLE}.date_last_played),
+                       {', '.join(f"o.{column}" for column in METADATA_COLUMNS)}
+                FROM LibraryItem o
+                WHERE o.path = {SHADOW_LIBRARY_TABLE}.path AND o.type = {SHADOW_LIBRARY_TABLE}.type)
+            WHERE id IN (
+                SELECT s.id FROM {SCAN_EDITS_TABLE} e
+                JOIN LibraryItem o ON o.id = e.id
+                JOIN {SHADOW_LIBRARY_TABLE} s ON s.path = o.path AND s.type = o.type)
+        """)
+        recopied_count = cursor.rowcount
+        cursor.execute(f"DELETE FROM {SCAN_EDITS_TABLE}")
+        cursor.execute(f"DELETE FROM PlaylistSong WHERE NOT EXISTS ({new_id_for_entry})")
+        removed_count = cursor.rowcount
+        cursor.execute(f"UPDATE PlaylistSong SET library_item_id = ({new_id_for_entry}) WHERE library_item_id <> ({new_id_for_entry})")
+        remapped_count = cursor.rowcount
+        # Annotations and positions stay with items that keep their id at the same path
+        delete_item_state(cursor, f"""NOT EXISTS (
+            SELECT 1 FROM LibraryItem o JOIN {SHADOW_LIBRARY_TABLE} s ON s.id = o.id AND s.path = o.path
+            WHERE o.id = {{table}}.library_item_id)""")
+        stop_tracking_scan_edits(cursor)
+        # Legacy rename semantics keep PlaylistSong's reference pointing at 'LibraryItem'
+        # instead of following the old table to its retired name. The shadow table is renamed
+        # normally, so its own parent_id reference becomes 'LibraryItem' too.
+        cursor.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            cursor.execute(f"ALTER TABLE LibraryItem RENAME TO {RETIRED_LIBRARY_TABLE}")
+        finally:
+            cursor.execute("PRAGMA legacy_alter_table = OFF")
+        cursor.execute(f"ALTER TABLE {SHADOW_LIBRARY_TABLE} RENAME TO LibraryItem")
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    bump_library_generation()
+
+    if removed_count:
+        print(f"Warning: removed {removed_count} playlist entries whose PDFs were not found after rescan.")
+    print(f"Library swapped in. Remapped {remapped_count} playlist entries, refreshed {recopied_count} items edited during the scan.")
+
+def drop_retired_library(db):
+    """
+    Drops the table the last swap retired. Its indexes are dropped first and its rows deleted
+    SCAN_COMMIT_BATCH_SIZE at a time, each step in its own short transaction with a pause
+    for waiting write requests, so the final DROP TABLE has next to nothing to free.
+    """
+    cursor = db.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                   (RETIRED_LIBRARY_TABLE,))
+    for index_name in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute(f"DROP INDEX {index_name}")
+        db.commit()
+        wait_for_write_requests()
+    while True:
+        cursor.execute(f"DELETE FROM {RETIRED_LIBRARY_TABLE} WHERE rowid IN (SELECT rowid FROM {RETIRED_LIBRARY_TABLE} LIMIT ?)",
+                       (SCAN_COMMIT_BATCH_SIZE,))
+        deleted_count = cursor.rowcount
+        db.commit()
+        if deleted_count == 0:
+            break
+        wait_for_write_requests()
+    cursor.execute(f"DROP TABLE {RETIRED_LIBRARY_TABLE}")
+    db.commit()
 
+def backfill_library_paths(cursor):
+    """
+    Fills in the 'path' column for items created before it existed,
+    by walking the parent_id tree once from the top.
+    """
+    cursor.execute("SELECT COUNT(*) FROM LibraryItem WHERE path IS NULL")
+    if cursor.fetchone()[0] == 0:
+        return
+
+    cursor.execute("SELECT id, name, parent_id FROM LibraryItem")
+    children_by_parent = {}
+    for row in cursor.fetchall():
+        children_by_parent.setdefault(row['parent_id'], []).append(row)
+
+    updates = []
+    pending = [(row['id'], '') for row in children_by_parent.get(None, [])]
+    while pending:
+        item_id, item_path = pending.pop()
+        updates.append((item_path, item_id))
+        for child in children_by_parent.get(item_id, []):
+            pending.append((child['id'], posixpath.join(item_path, child['name']) if item_path else child['name']))
+
+    cursor.executemany("UPDATE LibraryItem SET path = ? WHERE id = ?", updates)
+    print(f"Backfilled path for {len(updates)} library items.")
+
+def migrate_create_base_tables(cursor):
+    """
+    Schema version 1: Config, LibraryItem (with metadata columns), Playlist and PlaylistSong,
+    plus the initial playlists. Safe to run on databases created before migrations were tracked.
+    """
     # Create Config table to store key-value settings
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS Config (
@@ -161,30 +725,14 @@ def init_db():
     ''')
 
     # Create LibraryItem table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS LibraryItem (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            type TEXT NOT NULL, -- 'folder' or 'pdf'
-            parent_id INTEGER,
-            pdf_url TEXT, -- Now stores relative paths like 'Classical/Beethoven.pdf'
-            date_created TEXT,
-            date_last_played TEXT,
-            FOREIGN KEY (parent_id) REFERENCES LibraryItem (id)
-        )
-    ''')
+    cursor.execute(LIBRARY_ITEM_TABLE_SQL.format(table='LibraryItem'))
 
     # Add metadata columns if they don't exist (for backward compatibility)
-    metadata_columns = {
-        'title': 'TEXT', 'composer': 'TEXT', 'genre': 'TEXT', 'tag': 'TEXT',
-        'label': 'TEXT', 'rating': 'TEXT', 'difficulty': 'TEXT', 'playtime': 'TEXT',
-        'key': 'TEXT', 'time': 'TEXT'
-    }
     cursor.execute("PRAGMA table_info(LibraryItem)")
     existing_columns = {row['name'] for row in cursor.fetchall()}
-    for col_name, col_type in metadata_columns.items():
+    for col_name in METADATA_COLUMNS:
         if col_name not in existing_columns:
-            cursor.execute(f"ALTER TABLE LibraryItem ADD COLUMN {col_name} {col_type}")
+            cursor.execute(f"ALTER TABLE LibraryItem ADD COLUMN {col_name} TEXT")
             print(f"Added column '{col_name}' to LibraryItem table.")
 
     # Create Playlist table
@@ -206,26 +754,6 @@ def init_db():
             FOREIGN KEY (library_item_id) REFERENCES LibraryItem (id)
         )
     ''')
-    db.commit()
-
-    # Load PDF storage path from Config table
-    cursor.execute("SELECT value FROM Config WHERE key = 'pdf_storage_path'")
-    config_row = cursor.fetchone()
-    if config_row:
-        PDF_STORAGE_PATH_VAR = config_row['value']
-        print(f"Loaded PDF_STORAGE_PATH_VAR from config: {PDF_STORAGE_PATH_VAR}")
-    else:
-        print("PDF_STORAGE_PATH_VAR not found in config. It remains unset.")
-
-    # Check if the library has any items. If not, perform an initial scan.
-    # This prevents wiping the database on every application start.
-    cursor.execute("SELECT COUNT(id) FROM LibraryItem")
-    item_count = cursor.fetchone()[0]
-    if item_count == 0:
-        print("Library is empty. Performing initial scan.")
-        scan_pdfs_and_populate_db()
-    else:
-        print(f"Library contains {item_count} items. Skipping scan on startup.")
 
     # Also ensure initial playlists are present if the Playlist table is empty
     cursor.execute("SELECT COUNT(*) FROM Playlist")
@@ -238,55 +766,175 @@ def init_db():
         ]
         for playlist_name in initial_playlists_names:
             cursor.execute("INSERT INTO Playlist (name) VALUES (?)", (playlist_name,))
-            db.commit() # Commit each playlist creation
         print("Initial playlists created.")
 
+def migrate_add_path_index(cursor):
+    """
+    Schema version 2: the materialized path index.
+    'path' is the item's location relative to the storage root using '/' separators
+    ('' for Root), so a whole subtree is one range scan on idx_LibraryItem_path.
+    'size' holds the PDF file size in bytes for recursive size totals.
+    Also makes sure the Root folder exists, so the library has a tree before the first scan.
+    """
+    cursor.execute("PRAGMA table_info(LibraryItem)")
+    existing_columns = {row['name'] for row in cursor.fetchall()}
+    for col_name, col_type in {'path': 'TEXT', 'size': 'INTEGER'}.items():
+        if col_name not in existing_columns:
+            cursor.execute(f"ALTER TABLE LibraryItem ADD COLUMN {col_name} {col_type}")
+            print(f"Added column '{col_name}' to LibraryItem table.")
+    backfill_library_paths(cursor)
+    if get_library_index_suffix(cursor) is None:
+        create_library_item_indexes(cursor, 'LibraryItem')
+
+    cursor.execute("INSERT OR IGNORE INTO LibraryItem (id, name, type, parent_id, pdf_url, date_created, date_last_played, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (1, "Root", "folder", None, None, datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'), None, ''))
+
+def migrate_add_annotations(cursor):
+    """
+    Schema version 3: per-page annotations and the last-viewed page of each PDF.
+    Annotation.strokes holds the page's strokes as zlib-compressed JSON (see compress_strokes).
+    'version' increases with every change to any page of the item, so a device can ask
+    for just the pages changed since it last synced.
+    Neither table references LibraryItem with a foreign key, because scans replace that table;
+    entries are cleaned up when their item disappears instead.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Annotation (
+            library_item_id INTEGER NOT NULL,
+            page INTEGER NOT NULL,
+            strokes BLOB NOT NULL,
+            stroke_count INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            device_id TEXT,
+            PRIMARY KEY (library_item_id, page)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ReadingPosition (
+            library_item_id INTEGER PRIMARY KEY,
+            page INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            device_id TEXT
+        )
+    ''')
+
+# Schema migrations in order; migration N brings the schema to version N.
+# The version is stored in the database's PRAGMA user_version, so an up-to-date
+# database costs a single version check at startup. Only ever append to this list.
+SCHEMA_MIGRATIONS = [
+    migrate_create_base_tables,
+    migrate_add_path_index,
+    migrate_add_annotations,
+]
+
+def run_schema_migrations(db, current_version):
+    """
+    Applies every migration newer than current_version, each in its own transaction
+    together with the user_version bump, so an interrupted upgrade resumes cleanly.
+    """
+    cursor = db.cursor()
+    # WAL lets readers keep using the current library while a scan writes its shadow table.
+    # The journal mode is stored in the database file, and cannot be changed inside a transaction.
+    cursor.execute("PRAGMA journal_mode=WAL")
+
+    for version, migration in enumerate(SCHEMA_MIGRATIONS, start=1):
+        if version <= current_version:
+            continue
+        print(f"Applying schema migration {version}: {migration.__name__}")
+        try:
+            cursor.execute("BEGIN")
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+def init_db():
+    """
+    Initializes the database: brings the schema up to date and loads the configuration.
+    This runs at import time, so it does no scanning; an empty library is scanned in the
+    background once the server is up (see start_background_tasks).
+    """
+    started = time.perf_counter()
+    db = get_db()
+    cursor = db.cursor()
+
+    cursor.execute("PRAGMA user_version")
+    schema_version = cursor.fetchone()[0]
+    if schema_version < len(SCHEMA_MIGRATIONS):
+        run_schema_migrations(db, schema_version)
+
+    # Load the storage roots (and with them PDF_STORAGE_PATH_VAR) from Config table
+    load_storage_roots(cursor)
+    if PDF_STORAGE_PATH_VAR:
+        print(f"Loaded PDF_STORAGE_PATH_VAR from config: {PDF_STORAGE_PATH_VAR}")
+    else:
+        print("PDF_STORAGE_PATH_VAR not found in config. It remains unset.")
+    if len(STORAGE_ROOTS) > 1:
+        print(f"Loaded {len(STORAGE_ROOTS) - 1} additional storage roots from config.")
+
+    print(f"Database ready (schema version {len(SCHEMA_MIGRATIONS)}) in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+def scan_if_library_empty():
+    """
+    Performs the initial scan if the library has no items besides Root.
+    This prevents wiping the database on every application start.
+    """
+    with app.app_context():
+        cursor = get_db().cursor()
+        cursor.execute("SELECT 1 FROM LibraryItem WHERE parent_id IS NOT NULL LIMIT 1")
+        if cursor.fetchone():
+            print("Library has items. Skipping initial scan.")
+            return
+        print("Library is empty. Performing initial scan in the background.")
+        try:
+            scan_pdfs_and_populate_db()
+        except Exception as e:
+            print(f"Error during initial library scan: {e}")
+
 
 # Register the close_db function to be called after each request
 app.teardown_appcontext(close_db)
 
+# Keep track of write requests, so a running scan can give way to them
+app.before_request(track_write_request_start)
+app.teardown_request(track_write_request_end)
+
 # Call init_db to set up the database when the app starts
 with app.app_context():
     init_db()
 
 # --- API Endpoints ---
 
-# Route to serve local PDF files from the PDF_STORAGE_PATH_VAR
+# Route to serve local PDF files from the storage roots
 @app.route('/local_pdfs/<path:filename>')
 def serve_pdf(filename):
     """
-    Serves PDF files from the configured PDF_STORAGE_PATH_VAR.
+    Serves PDF files from the configured storage roots.
     The <path:filename> converter allows the filename to include slashes,
-    enabling subdirectories within the storage path.
+    enabling subdirectories within the storage path. A first segment naming a
+    storage root selects that root (via the precomputed ROOT_LOOKUP); any other
+    path is served from the primary root, PDF_STORAGE_PATH_VAR.
     """
-    # Ensure PDF_STORAGE_PATH_VAR is set before attempting to serve
-    if not PDF_STORAGE_PATH_VAR or not os.path.isdir(PDF_STORAGE_PATH_VAR):
-        print(f"Error: PDF_STORAGE_PATH_VAR is not set or invalid when trying to serve '{filename}'. Current path: '{PDF_STORAGE_PATH_VAR}'")
-        return jsonify({"error": "PDF storage path not configured or invalid on server."}), 500
-
-    try:
-        print(f"Attempting to serve: {filename}")
-        print(f"PDF_STORAGE_PATH_VAR: {PDF_STORAGE_PATH_VAR}")
-        
-        # Construct the absolute path to the file expected to be served
-        full_path_to_file = os.path.join(PDF_STORAGE_PATH_VAR, filename)
-        
-        print(f"Full path to file being checked: {full_path_to_file}")
-        print(f"Does file exist at full path? {os.path.exists(full_path_to_file)}")
+    root_name, root_abs_path, relative_path = resolve_root(filename)
 
-        # Ensure the resolved path is still within the PDF_STORAGE_PATH_VAR
-        # This is a security check against directory traversal
-        abs_storage_path = os.path.abspath(PDF_STORAGE_PATH_VAR)
-        abs_requested_path = os.path.abspath(full_path_to_file)
+    # Ensure the root is configured before attempting to serve
+    if not root_abs_path:
+        print(f"Error: storage root '{root_name}' is not configured when trying to serve '{filename}'.")
+        return jsonify({"error": "PDF storage path not configured or invalid on server."}), 500
 
-        if not abs_requested_path.startswith(abs_storage_path):
-            print(f"Security Warning: Attempted path outside storage directory: {abs_requested_path}")
-            return jsonify({"error": "Unauthorized access to file"}), 403
+    # Don't touch a root known to be offline; a hung network mount would block this request
+    if not is_root_online(root_name):
+        return jsonify({"error": f"Storage root '{root_name}' is currently offline."}), 503
 
+    try:
         # send_from_directory handles security like preventing directory traversal internally
-        return send_from_directory(PDF_STORAGE_PATH_VAR, filename)
+        # (safe_join rejects absolute paths and '..' segments that would leave the root)
+        return send_from_directory(root_abs_path, relative_path)
     except NotFound: # Catch NotFound specifically from send_from_directory
-        print(f"Flask NotFound: PDF file not found by send_from_directory at: {full_path_to_file}")
+        print(f"Flask NotFound: PDF file not found by send_from_directory: '{relative_path}' in root '{root_name}'")
         return jsonify({"error": "PDF file not found on server."}), 404
     except Exception as e:
         print(f"General Error serving PDF '{filename}': {e}")
@@ -319,21 +967,26 @@ def get_library():
         print("Warning: 'Root' folder not found in LibraryItem table. Returning empty structure.")
         return jsonify({"name": "Root", "type": "folder", "contents": []})
 
+    # Group items by parent once, so building the tree is a single pass instead of
+    # rescanning the whole flat list for every folder
+    children_by_parent = {}
+    for item in items_flat:
+        children_by_parent.setdefault(item['parent_id'], []).append(item)
+
     # Recursive function to build the nested structure
-    def build_nested_structure(flat_list, current_parent_id):
+    def build_nested_structure(current_parent_id):
         children = []
-        for item in flat_list:
-            if item['parent_id'] == current_parent_id:
-                child_copy = dict(item) # Create a copy to modify
-                if child_copy['type'] == 'folder':
-                    child_copy['contents'] = build_nested_structure(flat_list, child_copy['id'])
-                children.append(child_copy)
+        for item in children_by_parent.get(current_parent_id, []):
+            child_copy = dict(item) # Create a copy to modify
+            if child_copy['type'] == 'folder':
+                child_copy['contents'] = build_nested_structure(child_copy['id'])
+            children.append(child_copy)
         
         # Sort folders first, then PDFs, then by name (case-insensitive for name)
         return sorted(children, key=lambda x: (x['type'] == 'pdf', x['name'].lower()))
 
     # Build the contents of the main 'Library' which are direct children of the 'Root' folder
-    library_contents = build_nested_structure(items_flat, root_folder_id)
+    library_contents = build_nested_structure(root_folder_id)
 
     return jsonify({"name": "Root", "type": "folder", "contents": library_contents})
 
@@ -350,6 +1003,7 @@ def update_library_item_play_date(item_id):
         db.execute("UPDATE LibraryItem SET date_last_played = ? WHERE id = ?",
                    (current_time_iso, item_id))
         db.commit()
+        note_item_played(item_id, current_time_iso)
         return jsonify({"message": f"date_last_played for item {item_id} updated."}), 200
     except sqlite3.Error as e:
         db.rollback()
@@ -378,10 +1032,16 @@ def get_library_item(item_id):
 def rescan_library_api():
     """
     API endpoint to trigger a rescan and repopulation of the library.
+    Optional 'roots' (list of storage root names) in the JSON body limits the scan to those roots.
     """
+    data = request.get_json(silent=True) or {}
+    root_names = data.get('roots')
+    if root_names is not None and (not isinstance(root_names, list) or not all(find_storage_root(name) for name in root_names)):
+        return jsonify({"error": "'roots' must be a list of configured storage root names."}), 400
+
     try:
         with app.app_context(): # Ensure we are in the app context for DB operations
-            scan_pdfs_and_populate_db()
+            scan_pdfs_and_populate_db(root_names)
         return jsonify({"message": "Library scan initiated and database updated successfully."}), 200
     except Exception as e:
         print(f"Error during library rescan: {e}")
@@ -390,11 +1050,10 @@ def rescan_library_api():
 @app.route('/api/update_pdf_path', methods=['POST'])
 def update_pdf_path():
     """
-    API endpoint to update the PDF_STORAGE_PATH_VAR.
+    API endpoint to update the PDF_STORAGE_PATH_VAR (the primary storage root).
     Requires 'new_path' in the request JSON body.
-    Triggers a rescan of the library after updating the path.
+    Triggers a rescan of the primary root after updating the path.
     """
-    global PDF_STORAGE_PATH_VAR # Declare intent to modify the global variable
     db = get_db()
     data = request.get_json()
     new_path = data.get('new_path')
@@ -413,14 +1072,14 @@ def update_pdf_path():
         except OSError as e:
             return jsonify({"error": f"Invalid or inaccessible path: {str(e)}"}), 400
 
-    # Update global variable
-    PDF_STORAGE_PATH_VAR = normalized_path
+    # Update the primary root (and with it PDF_STORAGE_PATH_VAR)
+    set_primary_storage_path(normalized_path)
     print(f"PDF_STORAGE_PATH_VAR updated to: {PDF_STORAGE_PATH_VAR}")
 
     # Save the updated path to the Config table
     try:
         cursor = db.cursor()
-        cursor.execute("INSERT OR REPLACE INTO Config (key, value) VALUES (?, ?)", ('pdf_storage_path', PDF_STORAGE_PATH_VAR))
+        save_storage_roots(cursor)
         db.commit()
         print("PDF storage path saved to database.")
     except sqlite3.Error as e:
@@ -431,7 +1090,7 @@ def update_pdf_path():
 
     try:
         with app.app_context():
-            scan_pdfs_and_populate_db() # Rescan with the new path
+            scan_pdfs_and_populate_db([PRIMARY_ROOT_NAME]) # Rescan with the new path
         return jsonify({"message": f"Library path updated to '{new_path}' and rescanned."}), 200
     except Exception as e:
         print(f"Error during library rescan after path update: {e}")
@@ -449,6 +1108,7 @@ def get_pdf_storage_path():
         return jsonify({"path": None, "message": "PDF storage path is not set."}), 200
 
 @app.route('/api/library/rename/<int:item_id>', methods=['POST'])
+@requires_scan_lock
 def rename_library_item(item_id):
     """
     API endpoint to rename a PDF item in the library and its corresponding file on the server.
@@ -462,7 +1122,7 @@ def rename_library_item(item_id):
         return jsonify({"error": "New name is required"}), 400
 
     cursor = db.cursor()
-    cursor.execute("SELECT name, pdf_url, type FROM LibraryItem WHERE id = ?", (item_id,))
+    cursor.execute("SELECT name, pdf_url, type, path FROM LibraryItem WHERE id = ?", (item_id,))
     item = cursor.fetchone()
 
     if not item:
@@ -488,13 +1148,12 @@ def rename_library_item(item_id):
     
     new_relative_path = os.path.join(old_dirname, new_name)
 
-    # Use the globally configured PDF_STORAGE_PATH_VAR
-    if not PDF_STORAGE_PATH_VAR:
+    # Resolve both paths against the storage root the item lives in
+    old_abs_path = get_abs_path_for(old_relative_path)
+    new_abs_path = get_abs_path_for(new_relative_path)
+    if not old_abs_path:
         return jsonify({"error": "PDF storage path is not configured on the server."}), 500
 
-    old_abs_path = os.path.join(PDF_STORAGE_PATH_VAR, old_relative_path)
-    new_abs_path = os.path.join(PDF_STORAGE_PATH_VAR, new_relative_path)
-
     # Basic check to prevent overwriting existing files or invalid paths
     if os.path.exists(new_abs_path) and old_abs_path != new_abs_path:
         return jsonify({"error": "A file with this new name already exists in the folder."}), 409
@@ -505,10 +1164,12 @@ def rename_library_item(item_id):
     try:
         os.rename(old_abs_path, new_abs_path)
         
-        # Update database entry
-        cursor.execute("UPDATE LibraryItem SET name = ?, pdf_url = ? WHERE id = ?",
-                       (new_name, new_relative_path, item_id))
+        # Update database entry, keeping the materialized path in step with pdf_url
+        new_path = new_relative_path.replace(os.sep, '/')
+        cursor.execute("UPDATE LibraryItem SET name = ?, pdf_url = ?, path = ? WHERE id = ?",
+                       (new_name, new_relative_path, new_path, item_id))
         db.commit()
+        bump_library_generation()
         return jsonify({"message": f"Successfully renamed '{old_filename}' to '{new_name}'."}), 200
     except OSError as e:
         db.rollback()
@@ -526,10 +1187,7 @@ def update_library_item_metadata(item_id):
     data = request.get_json()
 
     # These are the fields the frontend can update.
-    allowed_fields = [
-        'title', 'composer', 'genre', 'tag', 'label', 'rating',
-        'difficulty', 'playtime', 'key', 'time'
-    ]
+    allowed_fields = METADATA_COLUMNS
 
     # Build the SET part of the SQL query dynamically and safely
     set_clauses = []
@@ -564,11 +1222,554 @@ def update_library_item_metadata(item_id):
         if cursor.rowcount == 0:
             return jsonify({"error": "Item not found"}), 404
         db.commit()
+        bump_library_generation()
         return jsonify({"message": "Metadata updated successfully."}), 200
     except sqlite3.Error as e:
         db.rollback()
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+# --- Storage Root Endpoints ---
+
+def describe_storage_root(root):
+    """Returns a root's settings together with its mount folder and last known status."""
+    status = ROOT_STATUS.get(root['name'], {})
+    last_scan = status.get('last_scan')
+    return dict(root, mount=get_root_mount(root), primary=root['name'] == PRIMARY_ROOT_NAME,
+                online=status.get('online'), error=status.get('error'), checked_at=status.get('checked_at'),
+                last_scan=datetime.fromtimestamp(last_scan, tz=timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z') if last_scan else None)
+
+@app.route('/api/storage_roots', methods=['GET'])
+def get_storage_roots():
+    """
+    API endpoint to list the storage roots with their settings and availability.
+    All roots are checked concurrently, each bounded by its check_timeout.
+    """
+    check_storage_roots(STORAGE_ROOTS)
+    return jsonify([describe_storage_root(root) for root in STORAGE_ROOTS]), 200
+
+@app.route('/api/storage_roots', methods=['POST'])
+def save_storage_root():
+    """
+    API endpoint to add a storage root or change an existing root's settings.
+    Requires 'name' in the request JSON body, and 'path' for a new root.
+    Optional: 'scan_interval' (seconds, 0 = manual), 'scan_concurrency', 'check_timeout' (seconds).
+    A new root, or a root whose path changed, is scanned straight away.
+    """
+    db = get_db()
+    data = request.get_json() or {}
+    existing = find_storage_root(data.get('name'))
+
+    if not existing and not data.get('path'):
+        return jsonify({"error": "Path is required for a new storage root"}), 400
+    try:
+        root = normalize_storage_root(data, existing)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    path_changed = root.get('path') != (existing or {}).get('path')
+    if path_changed and not os.path.isdir(root['path']):
+        return jsonify({"error": f"Path '{root['path']}' is not an accessible directory."}), 400
+
+    cursor = db.cursor()
+    if not existing:
+        # The root's mount folder must not clash with a folder or PDF already at the top level
+        cursor.execute("SELECT COUNT(*) FROM LibraryItem WHERE parent_id = 1 AND name = ?", (root['name'],))
+        if cursor.fetchone()[0] > 0:
+            return jsonify({"error": f"An item named '{root['name']}' already exists at the top of the library."}), 409
+
+    if root['name'] == PRIMARY_ROOT_NAME:
+        roots = [root] + STORAGE_ROOTS[1:]
+    elif existing:
+        roots = [root if r['name'] == root['name'] else r for r in STORAGE_ROOTS]
+    else:
+        roots = STORAGE_ROOTS + [root]
+
+    try:
+        set_storage_roots(roots)
+        save_storage_roots(cursor)
+        db.commit()
+    except sqlite3.Error as e:
+        db.rollback()
+        return jsonify({"error": f"Failed to save storage roots: {str(e)}"}), 500
+
+    if path_changed:
+        try:
+            scan_pdfs_and_populate_db([root['name']])
+        except Exception as e:
+            print(f"Error during scan of storage root '{root['name']}': {e}")
+            return jsonify({"error": f"Storage root saved, but the scan failed: {str(e)}"}), 500
+
+    return jsonify(describe_storage_root(root)), 200 if existing else 201
+
+@app.route('/api/storage_roots/<name>', methods=['DELETE'])
+@requires_scan_lock
+def delete_storage_root(name):
+    """
+    API endpoint to remove a storage root. Its items are removed from the library
+    (files on disk are not touched). The primary root cannot be removed.
+    """
+    db = get_db()
+    if name == PRIMARY_ROOT_NAME:
+        return jsonify({"error": "The primary storage root cannot be removed."}), 400
+    if not find_storage_root(name):
+        return jsonify({"error": "Storage root not found"}), 404
+
+    # The root's items are exactly its mount folder's subtree
+    lower, upper = get_subtree_bounds(name)
+    subtree_condition = "path = ? OR (path > ? AND path < ?)"
+    try:
+        cursor = db.cursor()
+        cursor.execute(f"DELETE FROM PlaylistSong WHERE library_item_id IN (SELECT id FROM LibraryItem WHERE {subtree_condition})",
+                       (name, lower, upper))
+        delete_item_state(cursor, f"library_item_id IN (SELECT id FROM LibraryItem WHERE {subtree_condition})", (name, lower, upper))
+        cursor.execute(f"DELETE FROM LibraryItem WHERE {subtree_condition}", (name, lower, upper))
+        removed_count = cursor.rowcount
+        set_storage_roots([root for root in STORAGE_ROOTS if root['name'] != name])
+        save_storage_roots(cursor)
+        db.commit()
+        ROOT_STATUS.pop(name, None)
+        bump_library_generation()
+    except sqlite3.Error as e:
+        db.rollback()
+        return jsonify({"error": f"Failed to remove storage root: {str(e)}"}), 500
+    print(f"Removed storage root '{name}' and its {removed_count} library items.")
+    return jsonify({"message": f"Storage root '{name}' removed."}), 200
+
+@app.route('/api/storage_roots/<name>/scan', methods=['POST'])
+def scan_storage_root(name):
+    """
+    API endpoint to rescan a single storage root; all other roots keep their items.
+    """
+    root = find_storage_root(name)
+    if not root:
+        return jsonify({"error": "Storage root not found"}), 404
+    if root.get('path') and root['name'] not in check_storage_roots([root]):
+        return jsonify({"error": f"Storage root '{name}' is offline: {ROOT_STATUS[name].get('error')}"}), 503
+
+    try:
+        scan_pdfs_and_populate_db([name])
+    except Exception as e:
+        print(f"Error during scan of storage root '{name}': {e}")
+        return jsonify({"error": f"Failed to scan storage root: {str(e)}"}), 500
+    return jsonify({"message": f"Storage root '{name}' scanned."}), 200
+
+
+# --- Folder Subtree Operations ---
+
+# Characters just after '/' and after every other character in code point order.
+# Every descendant of a folder at 'A/B' has a path strictly between 'A/B/' and 'A/B0'.
+SUBTREE_UPPER_BOUND_SUFFIX = '0'
+MAX_PATH_CHARACTER = chr(0x10FFFF)
+
+def get_subtree_bounds(folder_path):
+    """
+    Returns the exclusive (lower, upper) bounds on 'path' that select every
+    descendant of the folder at folder_path, for use as an indexed range scan.
+    """
+    if folder_path == '':
+        # Root: every other item is a descendant
+        return '', MAX_PATH_CHARACTER
+    return folder_path + '/', folder_path + SUBTREE_UPPER_BOUND_SUFFIX
+
+def rewrite_subtree_paths(cursor, old_path, new_path):
+    """
+    Rewrites 'path' (and 'pdf_url' for PDFs) of an item and all its descendants
+    from old_path to new_path with a single UPDATE. The caller owns the transaction.
+    """
+    lower, upper = get_subtree_bounds(old_path)
+    suffix_start = len(old_path) + 1 # substr() is 1-indexed
+    cursor.execute("""
+        UPDATE LibraryItem
+        SET path = ? || substr(path, ?),
+            pdf_url = CASE WHEN type = 'pdf' THEN replace(? || substr(path, ?), '/', ?) ELSE pdf_url END
+        WHERE path = ? OR (path > ? AND path < ?)
+    """, (new_path, suffix_start, new_path, suffix_start, os.sep, old_path, lower, upper))
+    return cursor.rowcount
+
+def get_folder_row(cursor, folder_id):
+    """
+    Fetches a folder's id, name, parent_id and path, or None if it is not a folder.
+    """
+    cursor.execute("SELECT id, name, parent_id, path FROM LibraryItem WHERE id = ? AND type = 'folder'", (folder_id,))
+    return cursor.fetchone()
+
+@app.route('/api/library/folders/<int:folder_id>/subtree', methods=['GET'])
+def get_folder_subtree(folder_id):
+    """
+    API endpoint to list every item below a folder (at any depth) as a flat list ordered by path.
+    Optional query parameter 'type' ('pdf' or 'folder') restricts the result.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    folder = get_folder_row(cursor, folder_id)
+    if not folder:
+        return jsonify({"error": "Folder not found"}), 404
+
+    item_type = request.args.get('type')
+    if item_type not in (None, 'pdf', 'folder'):
+        return jsonify({"error": "Invalid type. Must be 'pdf' or 'folder'."}), 400
+
+    lower, upper = get_subtree_bounds(folder['path'])
+    sql_query = """
+        SELECT id, name, type, parent_id, pdf_url AS file_path, path, size, date_created, date_last_played
+        FROM LibraryItem
+        WHERE path > ? AND path < ?
+    """
+    values = [lower, upper]
+    if item_type:
+        sql_query += " AND type = ?"
+        values.append(item_type)
+    sql_query += " ORDER BY path"
+    cursor.execute(sql_query, tuple(values))
+
+    items = [dict(row) for row in cursor.fetchall()]
+    return jsonify({"folder": dict(folder), "items": items}), 200
+
+@app.route('/api/library/folders/<int:folder_id>/stats', methods=['GET'])
+def get_folder_stats(folder_id):
+    """
+    API endpoint to get recursive PDF counts, folder counts and total sizes
+    for a folder and every folder below it.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    folder = get_folder_row(cursor, folder_id)
+    if not folder:
+        return jsonify({"error": "Folder not found"}), 404
+
+    lower, upper = get_subtree_bounds(folder['path'])
+    # For each folder f in the subtree, join the range of paths below f.
+    # Both sides are range scans on idx_LibraryItem_path.
+    cursor.execute("""
+        SELECT f.id, f.name, f.parent_id, f.path,
+               COALESCE(SUM(i.type = 'pdf'), 0) AS pdf_count,
+               COALESCE(SUM(i.type = 'folder'), 0) AS folder_count,
+               COALESCE(SUM(i.size), 0) AS total_size
+        FROM (
+            SELECT id, name, parent_id, path FROM LibraryItem WHERE id = ?
+            UNION ALL
+            SELECT id, name, parent_id, path FROM LibraryItem WHERE path > ? AND path < ? AND type = 'folder'
+        ) f
+        LEFT JOIN LibraryItem i
+            ON i.path > CASE WHEN f.path = '' THEN '' ELSE f.path || '/' END
+           AND i.path < CASE WHEN f.path = '' THEN ? ELSE f.path || ? END
+        GROUP BY f.id
+        ORDER BY f.path
+    """, (folder_id, lower, upper, MAX_PATH_CHARACTER, SUBTREE_UPPER_BOUND_SUFFIX))
+
+    folders = [dict(row) for row in cursor.fetchall()]
+    return jsonify(folders), 200
+
+@app.route('/api/library/<int:item_id>/breadcrumbs', methods=['GET'])
+def get_item_breadcrumbs(item_id):
+    """
+    API endpoint to get the chain of folders from Root down to an item (inclusive).
+    """
+    db = get_db()
+    cursor = db.cursor()
+    # Walk up the parent_id chain; every step is a primary key lookup
+    cursor.execute("""
+        WITH RECURSIVE ancestors(id, name, type, parent_id, depth) AS (
+            SELECT id, name, type, parent_id, 0 FROM LibraryItem WHERE id = ?
+            UNION ALL
+            SELECT li.id, li.name, li.type, li.parent_id, a.depth + 1
+            FROM LibraryItem li JOIN ancestors a ON li.id = a.parent_id
+        )
+        SELECT id, name, type, parent_id FROM ancestors ORDER BY depth DESC
+    """, (item_id,))
+    breadcrumbs = [dict(row) for row in cursor.fetchall()]
+    if not breadcrumbs:
+        return jsonify({"error": "Item not found"}), 404
+    return jsonify(breadcrumbs), 200
+
+@app.route('/api/library/folders/<int:folder_id>/move', methods=['POST'])
+@requires_scan_lock
+def move_library_folder(folder_id):
+    """
+    API endpoint to move a folder (and everything in it) into another folder,
+    both on disk and in the database.
+    Requires 'target_folder_id' in the request JSON body.
+    All paths in the subtree are rewritten in one transaction; if that fails,
+    the folder is moved back on disk.
+    """
+    db = get_db()
+    data = request.get_json()
+    target_folder_id = data.get('target_folder_id')
+
+    if not target_folder_id:
+        return jsonify({"error": "Target folder ID is required"}), 400
+
+    cursor = db.cursor()
+    folder = get_folder_row(cursor, folder_id)
+    target = get_folder_row(cursor, target_folder_id)
+    if not folder or not target:
+        return jsonify({"error": "Folder not found"}), 404
+    if folder['parent_id'] is None:
+        return jsonify({"error": "The Root folder cannot be moved."}), 400
+    if folder['path'] in ROOT_LOOKUP:
+        return jsonify({"error": "A storage root folder cannot be moved."}), 400
+
+    old_path = folder['path']
+    if target['path'] == old_path or target['path'].startswith(old_path + '/'):
+        return jsonify({"error": "A folder cannot be moved into itself."}), 400
+    if target['id'] == folder['parent_id']:
+        return jsonify({"message": "Folder is already in the target folder."}), 200
+
+    new_path = posixpath.join(target['path'], folder['name']) if target['path'] else folder['name']
+    if resolve_root(old_path)[0] != resolve_root(new_path)[0]:
+        return jsonify({"error": "Folders cannot be moved between storage roots."}), 400
+
+    old_abs_path = get_abs_path_for(old_path)
+    new_abs_path = get_abs_path_for(new_path)
+    if not old_abs_path:
+        return jsonify({"error": "PDF storage path is not configured on the server."}), 500
+
+    cursor.execute("SELECT COUNT(*) FROM LibraryItem WHERE path = ?", (new_path,))
+    if cursor.fetchone()[0] > 0 or os.path.exists(new_abs_path):
+        return jsonify({"error": "An item with this name already exists in the target folder."}), 409
+
+    if not os.path.isdir(old_abs_path):
+        return jsonify({"error": "Original folder not found on server."}), 404
+
+    try:
+        os.rename(old_abs_path, new_abs_path)
+    except OSError as e:
+        return jsonify({"error": f"Server file system error: {str(e)}"}), 500
+
+    try:
+        moved_count = rewrite_subtree_paths(cursor, old_path, new_path)
+        cursor.execute("UPDATE LibraryItem SET parent_id = ? WHERE id = ?", (target['id'], folder_id))
+        db.commit()
+        bump_library_generation()
+    except sqlite3.Error as e:
+        db.rollback()
+        # Put the folder back so disk and database stay consistent
+        try:
+            os.rename(new_abs_path, old_abs_path)
+        except OSError as restore_error:
+            print(f"Error: could not move '{new_abs_path}' back to '{old_abs_path}': {restore_error}")
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    return jsonify({"message": f"Moved '{folder['name']}' to '{target['name']}'.", "updated_items": moved_count}), 200
+
+# --- Batch File Operations ---
+
+# Upper bound on operations per batch request
+MAX_BATCH_OPERATIONS = 1000
+
+# Renames on disk run on these workers. The pool is shared by all requests, so concurrent
+# batches together never have more than this many file system operations in flight.
+FILE_OPERATION_WORKERS = 8
+_file_operation_executor = ThreadPoolExecutor(max_workers=FILE_OPERATION_WORKERS, thread_name_prefix='file-ops')
+
+def get_path_chain(path):
+    """Returns the path itself followed by each of its ancestor folder paths ('A/B/c' -> 'A/B/c', 'A/B', 'A')."""
+    chain = [path]
+    while '/' in path:
+        path = path.rpartition('/')[0]
+        chain.append(path)
+    return chain
+
+def plan_file_operation(operation, items):
+    """
+    Works out what one batch operation does, using only the already loaded items.
+    Returns a plan dict, None if the operation would leave the item where it is,
+    or raises ValueError describing why the operation is invalid.
+    """
+    if not isinstance(operation, dict):
+        raise ValueError("Each operation must be an object.")
+    op = operation.get('op')
+    if op not in ('rename', 'move'):
+        raise ValueError("'op' must be 'rename' or 'move'.")
+    item = items.get(operation.get('item_id'))
+    if not item:
+        raise ValueError("Item not found.")
+    if item['parent_id'] is None:
+        raise ValueError("The Root folder cannot be renamed or moved.")
+    if item['type'] == 'folder' and item['path'] in ROOT_LOOKUP:
+        raise ValueError("A storage root folder cannot be renamed or moved.")
+
+    parent_id = item['parent_id']
+    name = item['name']
+    parent_path = item['path'].rpartition('/')[0]
+    if op == 'rename':
+        name = operation.get('new_name')
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("'new_name' is required.")
+        name = name.strip()
+        if '/' in name or os.sep in name or '\0' in name or name in ('.', '..'):
+            raise ValueError("Invalid name.")
+        # PDFs keep their .pdf extension, as with single renames
+        if item['type'] == 'pdf' and not name.lower().endswith('.pdf'):
+            name += '.pdf'
+    else:
+        target = items.get(operation.get('target_folder_id'))
+        if not target or target['type'] != 'folder':
+            raise ValueError("Target folder not found.")
+        if target['path'] == item['path'] or target['path'].startswith(item['path'] + '/'):
+            raise ValueError("A folder cannot be moved into itself.")
+        parent_id = target['id']
+        parent_path = target['path']
+
+    new_path = f"{parent_path}/{name}" if parent_path else name
+    if new_path == item['path']:
+        return None
+    if resolve_root(item['path'])[0] != resolve_root(new_path)[0]:
+        raise ValueError("Items cannot be moved between storage roots.")
+
+    old_abs_path = get_abs_path_for(item['path'])
+    if not old_abs_path:
+        raise ValueError("The item's storage root is not configured on the server.")
+    return {'item': item, 'name': name, 'parent_id': parent_id, 'old_path': item['path'], 'new_path': new_path,
+            'old_abs_path': old_abs_path, 'new_abs_path': get_abs_path_for(new_path)}
+
+def plan_file_operations(cursor, operations, results):
+    """
+    Plans a whole batch up front. Every item involved is loaded in one query, and collisions
+    (two operations on overlapping subtrees, two items given the same path, or a path
+    already taken in the library) are found in memory. Invalid operations get an error
+    in their result entry. Returns the plans that can go ahead, in request order.
+    """
+    referenced_ids = {value for operation in operations if isinstance(operation, dict)
+                      for value in (operation.get('item_id'), operation.get('target_folder_id'))
+                      if isinstance(value, int) and not isinstance(value, bool)}
+    items = {}
+    if referenced_ids:
+        id_list = list(referenced_ids)
+        placeholders = ', '.join('?' for _ in id_list)
+        cursor.execute(f"SELECT id, name, type, parent_id, path FROM LibraryItem WHERE id IN ({placeholders})", id_list)
+        items = {row['id']: row for row in cursor.fetchall()}
+
+    candidates = []
+    for index, operation in enumerate(operations):
+        try:
+            plan = plan_file_operation(operation, items)
+        except ValueError as e:
+            results[index].update({"status": "failed", "error": str(e)})
+            continue
+        if plan is None:
+            results[index]['status'] = "unchanged"
+            continue
+        plan['index'] = index
+        candidates.append(plan)
+
+    # Destinations already used by an item in the library
+    taken_paths = set()
+    destinations = [plan['new_path'] for plan in candidates]
+    for start in range(0, len(destinations), 500):
+        chunk = destinations[start:start + 500]
+        cursor.execute(f"SELECT path FROM LibraryItem WHERE path IN ({', '.join('?' for _ in chunk)})", chunk)
+        taken_paths.update(row['path'] for row in cursor.fetchall())
+
+    # Accepted operations never overlap, so they can run in any order (and in parallel)
+    claimed_sources = set()        # Paths of items being moved
+    claimed_destinations = set()   # Paths items are being moved to
+    claimed_outer_paths = set()    # Every folder above (or at) a source or destination
+    plans = []
+    for plan in candidates:
+        result = results[plan['index']]
+        source_chain = get_path_chain(plan['old_path'])
+        destination_chain = get_path_chain(plan['new_path'])
+        if plan['new_path'] in taken_paths:
+            result.update({"status": "failed", "error": f"An item named '{plan['name']}' already exists in the target folder."})
+        elif plan['new_path'] in claimed_destinations:
+            result.update({"status": "failed", "error": f"Another operation in this batch also moves an item to '{plan['new_path']}'."})
+        elif any(path in claimed_sources for path in source_chain + destination_chain) or plan['old_path'] in claimed_outer_paths:
+            result.update({"status": "failed", "error": "Overlaps another operation in this batch."})
+        else:
+            claimed_sources.add(plan['old_path'])
+            claimed_destinations.add(plan['new_path'])
+            claimed_outer_paths.update(source_chain)
+            claimed_outer_paths.update(destination_chain)
+            plans.append(plan)
+    return plans
+
+def rename_on_disk(source, destination):
+    """Renames one file or folder, refusing to replace anything already at the destination."""
+    if os.path.lexists(destination):
+        raise FileExistsError(f"'{destination}' already exists on disk.")
+    os.rename(source, destination)
+
+def run_disk_renames(pairs):
+    """
+    Runs (source, destination) renames on the shared worker pool.
+    Returns a list with None for each rename that worked and the OSError for each that did not.
+    """
+    futures = [_file_operation_executor.submit(rename_on_disk, source, destination) for source, destination in pairs]
+    outcomes = []
+    for future in futures:
+        try:
+            future.result()
+            outcomes.append(None)
+        except OSError as e:
+            outcomes.append(e)
+    return outcomes
+
+@app.route('/api/library/batch', methods=['POST'])
+@requires_scan_lock
+def batch_file_operations():
+    """
+    API endpoint to rename and move many PDFs and folders in one request.
+    Requires 'operations' in the JSON body, a list of:
+      {'op': 'rename', 'item_id': ..., 'new_name': ...}      (PDFs and folders)
+      {'op': 'move', 'item_id': ..., 'target_folder_id': ...}  (PDFs and folders)
+    The batch is planned and checked for collisions before anything is touched. Renames on disk
+    then run in parallel, and the database (whole subtrees for folders) is updated in one
+    transaction; if that fails, the renames are undone on disk.
+    Returns a result per operation: 'done', 'unchanged' or 'failed' with an error.
+    """
+    db = get_db()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object."}), 400
+    operations = data.get('operations')
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "'operations' must be a non-empty list."}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch."}), 400
+
+    results = [{"index": index, "item_id": operation.get('item_id') if isinstance(operation, dict) else None}
+               for index, operation in enumerate(operations)]
+    cursor = db.cursor()
+    plans = plan_file_operations(cursor, operations, results)
+
+    outcomes = run_disk_renames([(plan['old_abs_path'], plan['new_abs_path']) for plan in plans])
+    moved = []
+    for plan, error in zip(plans, outcomes):
+        if error:
+            results[plan['index']].update({"status": "failed", "error": f"Server file system error: {error}"})
+        else:
+            moved.append(plan)
+
+    if moved:
+        try:
+            for plan in moved:
+                rewrite_subtree_paths(cursor, plan['old_path'], plan['new_path'])
+                cursor.execute("UPDATE LibraryItem SET name = ?, parent_id = ? WHERE id = ?",
+                               (plan['name'], plan['parent_id'], plan['item']['id']))
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            # Put everything back so disk and database stay consistent
+            undo_outcomes = run_disk_renames([(plan['new_abs_path'], plan['old_abs_path']) for plan in moved])
+            for plan, undo_error in zip(moved, undo_outcomes):
+                error = f"Database error: {str(e)}"
+                if undo_error:
+                    print(f"Error: could not move '{plan['new_abs_path']}' back to '{plan['old_abs_path']}': {undo_error}")
+                    error += f" (the item could not be moved back on disk: {undo_error})"
+                results[plan['index']].update({"status": "failed", "error": error})
+            moved = []
+        else:
+            bump_library_generation()
+            for plan in moved:
+                results[plan['index']].update({"status": "done", "path": plan['new_path']})
+
+    failed_count = sum(1 for result in results if result['status'] == 'failed')
+    print(f"Batch file operations: {len(moved)} done, {failed_count} failed.")
+    return jsonify({"results": results, "done": len(moved), "failed": failed_count}), 200
+
+
 @app.route('/api/playlists', methods=['GET'])
 def get_playlists():
     """
@@ -614,20 +1815,17 @@ def create_playlist():
         db.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/playlists/<int:playlist_id>', methods=['GET'])
-def get_single_playlist(playlist_id):
+def fetch_playlist_with_songs(cursor, playlist_id):
     """
-    API endpoint to fetch a single playlist with its songs.
-    Songs are ordered by their 'order_index'.
+    Loads a playlist and its songs (ordered by 'order_index') as a plain dictionary.
+    Returns None if the playlist does not exist.
+    Shared by the playlist endpoint and the offline bundle export.
     """
-    db = get_db()
-    cursor = db.cursor()
-
     cursor.execute("SELECT id, name FROM Playlist WHERE id = ?", (playlist_id,))
     playlist = cursor.fetchone()
 
     if not playlist:
-        return jsonify({"error": "Playlist not found"}), 404
+        return None
 
     # Fetch songs for the playlist, joining with LibraryItem to get song details
     # Alias li.pdf_url as file_path to match frontend expectation
@@ -642,9 +1840,21 @@ def get_single_playlist(playlist_id):
     """, (playlist_id,))
     songs_rows = cursor.fetchall()
 
-    songs = [dict(song) for song in songs_rows]
     playlist_dict = dict(playlist)
-    playlist_dict['songs'] = songs
+    playlist_dict['songs'] = [dict(song) for song in songs_rows]
+    return playlist_dict
+
+@app.route('/api/playlists/<int:playlist_id>', methods=['GET'])
+def get_single_playlist(playlist_id):
+    """
+    API endpoint to fetch a single playlist with its songs.
+    Songs are ordered by their 'order_index'.
+    """
+    db = get_db()
+    playlist_dict = fetch_playlist_with_songs(db.cursor(), playlist_id)
+
+    if not playlist_dict:
+        return jsonify({"error": "Playlist not found"}), 404
 
     return jsonify(playlist_dict), 200
 
@@ -783,6 +1993,868 @@ def get_playlists_for_item(item_id):
     return jsonify(playlists), 200
 
 
+# --- Set List Builder ---
+
+# Seconds a generated set may differ from the requested duration when no tolerance is given
+SETLIST_DEFAULT_TOLERANCE = 30
+
+# Longest set, and largest tolerance, that can be requested, in seconds. Bounds the size of the subset-sum bitset.
+SETLIST_MAX_DURATION = 6 * 3600
+
+# How many differently shuffled searches are tried before giving up on the composer constraint
+SETLIST_SEARCH_ATTEMPTS = 5
+
+# Largest 'exclude_played_within_days' accepted; anything longer covers every play date anyway
+SETLIST_MAX_EXCLUDE_DAYS = 100 * 365
+
+# Bumped whenever library items are added, removed or edited, so cached views of the library
+# (such as the set list candidate index) know to rebuild.
+LIBRARY_GENERATION = 0
+
+# Candidate index for the set list builder: every PDF with a playtime, bucketed by genre and key.
+# Built on first use and rebuilt only when LIBRARY_GENERATION has moved on.
+_setlist_index = None
+_setlist_index_lock = threading.Lock()
+
+def bump_library_generation():
+    """Marks cached views of the library as stale."""
+    global LIBRARY_GENERATION
+    LIBRARY_GENERATION += 1
+
+def parse_duration(value):
+    """
+    Parses a duration given as seconds or as 'MM:SS' / 'H:MM:SS' text.
+    Returns the number of seconds, or None if the value is not a valid duration.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if value >= 0 else None
+    if not isinstance(value, str):
+        return None
+    match = re.match(r'^(?:(\d+):)?(\d{1,2}):(\d{2})$', value.strip())
+    if not match:
+        return None
+    hours, minutes, seconds = (int(part) if part else 0 for part in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+def format_duration(seconds):
+    """Formats seconds as 'MM:SS', or 'H:MM:SS' for an hour or more."""
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+def parse_difficulty(value):
+    """Difficulty is free text; returns it as a number when it is numeric, else None."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def normalize_filter_values(value):
+    """
+    Turns a filter given as a string or a list of strings into a set of lowercase values.
+    Raises ValueError for anything else.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(entry, str) for entry in value):
+        raise ValueError("must be a string or a list of strings")
+    return {entry.strip().lower() for entry in value}
+
+def get_setlist_index(db):
+    """
+    Returns the candidate index, rebuilding it with one pass over LibraryItem if the
+    library has changed since it was built. Each candidate is a dict; 'by_genre' and
+    'by_key' map lowercase values to the positions of the matching candidates.
+    """
+    global _setlist_index
+    index = _setlist_index
+    if index is not None and index['generation'] == LIBRARY_GENERATION:
+        return index
+
+    with _setlist_index_lock:
+        # Another request may have rebuilt it while we waited
+        index = _setlist_index
+        if index is not None and index['generation'] == LIBRARY_GENERATION:
+            return index
+
+        generation = LIBRARY_GENERATION
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT id, name, pdf_url AS file_path, date_last_played,
+                   title, composer, genre, difficulty, playtime, key
+            FROM LibraryItem
+            WHERE type = 'pdf' AND playtime IS NOT NULL AND playtime != ''
+        """)
+        candidates = []
+        by_genre = {}
+        by_key = {}
+        by_id = {}
+        for row in cursor.fetchall():
+            seconds = parse_duration(row['playtime'])
+            if not seconds:
+                continue
+            candidate = dict(row)
+            candidate['seconds'] = seconds
+            candidate['difficulty_value'] = parse_difficulty(row['difficulty'])
+            # Pieces without a composer never count as a repeat of each other
+            composer = (row['composer'] or '').strip().lower()
+            candidate['composer_key'] = composer or f"#{row['id']}"
+            position = len(candidates)
+            candidates.append(candidate)
+            by_id[row['id']] = position
+            if row['genre']:
+                by_genre.setdefault(row['genre'].strip().lower(), []).append(position)
+            if row['key']:
+                by_key.setdefault(row['key'].strip().lower(), []).append(position)
+
+        index = {'generation': generation, 'candidates': candidates,
+                 'by_genre': by_genre, 'by_key': by_key, 'by_id': by_id}
+        _setlist_index = index
+        print(f"Set list index built with {len(candidates)} candidates.")
+        return index
+
+def note_item_played(item_id, played_at):
+    """Keeps the cached index's last-played date current without forcing a rebuild."""
+    index = _setlist_index
+    if index is not None:
+        position = index['by_id'].get(item_id)
+        if position is not None:
+            index['candidates'][position]['date_last_played'] = played_at
+
+def select_setlist_candidates(index, genres, keys, difficulty_min, difficulty_max, played_before):
+    """Applies the request's filters to the index, using the genre/key buckets to narrow the pool first."""
+    positions = None
+    for wanted, buckets in ((genres, index['by_genre']), (keys, index['by_key'])):
+        if wanted is None:
+            continue
+        matching = set()
+        for value in wanted:
+            matching.update(buckets.get(value, ()))
+        positions = matching if positions is None else positions & matching
+
+    candidates = index['candidates']
+    pool = candidates if positions is None else [candidates[position] for position in sorted(positions)]
+
+    if difficulty_min is not None or difficulty_max is not None:
+        pool = [c for c in pool if c['difficulty_value'] is not None
+                and (difficulty_min is None or c['difficulty_value'] >= difficulty_min)
+                and (difficulty_max is None or c['difficulty_value'] <= difficulty_max)]
+    if played_before is not None:
+        pool = [c for c in pool if not c['date_last_played'] or c['date_last_played'] < played_before]
+    return pool
+
+def find_subset_near_duration(pool, target, tolerance):
+    """
+    Subset-sum search over the pool's playtimes. Reachable totals are kept as the bits of
+    one Python integer, so adding a piece is a single shift-and-or over every total at once.
+    The first piece to reach each total is remembered, which is enough to rebuild the set:
+    that piece was added to a total reached only by pieces considered before it.
+    Returns the chosen pieces, or None if no total lies within the tolerance.
+    """
+    limit = target + tolerance
+    mask = (1 << (limit + 1)) - 1
+    reachable = 1  # Only the empty set (total 0) to begin with
+    reached_by = {}
+    for candidate in pool:
+        seconds = candidate['seconds']
+        if seconds > limit:
+            continue
+        shifted = (reachable << seconds) & mask
+        new_totals = shifted & ~reachable
+        if not new_totals:
+            continue
+        reachable |= shifted
+        while new_totals:
+            lowest = new_totals & -new_totals
+            reached_by[lowest.bit_length() - 1] = candidate
+            new_totals ^= lowest
+        # An exact hit cannot be improved on
+        if (reachable >> target) & 1:
+            break
+
+    # Pick the reachable total closest to the target, from max(1, target - tolerance) to target + tolerance
+    for offset in range(tolerance + 1):
+        for total in (target - offset, target + offset):
+            if total > 0 and (reachable >> total) & 1:
+                chosen = []
+                while total:
+                    candidate = reached_by[total]
+                    chosen.append(candidate)
+                    total -= candidate['seconds']
+                chosen.reverse()
+                return chosen
+    return None
+
+def order_without_repeated_composer(pieces):
+    """
+    Orders the pieces so that no composer appears twice in a row, by always taking the
+    composer with the most pieces left other than the one just played.
+    Returns None if the mix makes that impossible.
+    """
+    groups = {}
+    for piece in pieces:
+        groups.setdefault(piece['composer_key'], []).append(piece)
+    if max(len(group) for group in groups.values()) > (len(pieces) + 1) // 2:
+        return None
+
+    ordered = []
+    previous = None
+    while len(ordered) < len(pieces):
+        composer = max((key for key, group in groups.items() if group and key != previous),
+                       key=lambda key: len(groups[key]))
+        ordered.append(groups[composer].pop())
+        previous = composer
+    return ordered
+
+@app.route('/api/playlists/generate', methods=['POST'])
+def generate_playlist():
+    """
+    API endpoint to build a set list that fits a target duration from the pieces' playtimes.
+    Requires 'target_duration' (seconds, 'MM:SS' or 'H:MM:SS') in the JSON body.
+    Optional: 'tolerance' (seconds), 'genre' and 'key' (a value or a list of values),
+    'difficulty_min'/'difficulty_max', 'exclude_played_within_days', 'no_repeat_composer',
+    'seed' (for a repeatable pick) and 'name' (saves the result as a new playlist).
+    """
+    db = get_db()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object."}), 400
+
+    target = parse_duration(data.get('target_duration'))
+    if not target:
+        return jsonify({"error": "A valid 'target_duration' is required (seconds, MM:SS or H:MM:SS)."}), 400
+    if target > SETLIST_MAX_DURATION:
+        return jsonify({"error": f"'target_duration' cannot exceed {format_duration(SETLIST_MAX_DURATION)}."}), 400
+
+    tolerance = parse_duration(data.get('tolerance', SETLIST_DEFAULT_TOLERANCE))
+    if tolerance is None:
+        return jsonify({"error": "Invalid 'tolerance'. Must be seconds or MM:SS."}), 400
+    # The tolerance widens the subset-sum bitset just like the target does, so it is bounded the same way
+    if tolerance > SETLIST_MAX_DURATION:
+        return jsonify({"error": f"'tolerance' cannot exceed {format_duration(SETLIST_MAX_DURATION)}."}), 400
+
+    seed = data.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, (int, str))):
+        return jsonify({"error": "Invalid 'seed'. Must be an integer or a string."}), 400
+
+    difficulty_min = parse_difficulty(data.get('difficulty_min'))
+    difficulty_max = parse_difficulty(data.get('difficulty_max'))
+    if (data.get('difficulty_min') not in (None, '') and difficulty_min is None) or \
+       (data.get('difficulty_max') not in (None, '') and difficulty_max is None):
+        return jsonify({"error": "Invalid difficulty range. Must be numbers."}), 400
+
+    played_before = None
+    if data.get('exclude_played_within_days') not in (None, ''):
+        try:
+            days = float(data.get('exclude_played_within_days'))
+            # Also rejects NaN, which fails every comparison
+            if not 0 <= days <= SETLIST_MAX_EXCLUDE_DAYS:
+                raise ValueError
+            cutoff = datetime.now(timezone.utc).timestamp() - days * 86400
+            played_before = datetime.fromtimestamp(cutoff, timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+        except (ValueError, TypeError, OverflowError, OSError):
+            return jsonify({"error": f"Invalid 'exclude_played_within_days'. Must be a number from 0 to {SETLIST_MAX_EXCLUDE_DAYS}."}), 400
+
+    filters = {}
+    for field in ('genre', 'key'):
+        try:
+            filters[field] = normalize_filter_values(data.get(field))
+        except ValueError:
+            return jsonify({"error": f"Invalid '{field}'. Must be a string or a list of strings."}), 400
+
+    no_repeat_composer = bool(data.get('no_repeat_composer', False))
+    name = data.get('name')
+    if name is not None and (not isinstance(name, str) or not name.strip()):
+        return jsonify({"error": "Invalid 'name'. Must be a non-empty string."}), 400
+
+    index = get_setlist_index(db)
+    pool = select_setlist_candidates(index, filters['genre'], filters['key'],
+                                     difficulty_min, difficulty_max, played_before)
+    if not pool:
+        return jsonify({"error": "No pieces with a playtime match the given filters."}), 422
+
+    # Each attempt searches the pool in a different random order, so repeated requests give varied sets
+    rng = random.Random(seed)
+    pieces = None
+    for _ in range(SETLIST_SEARCH_ATTEMPTS):
+        shuffled = pool[:]
+        rng.shuffle(shuffled)
+        chosen = find_subset_near_duration(shuffled, target, tolerance)
+        if chosen is None:
+            # Every order reaches the same totals, so retrying cannot help
+            return jsonify({"error": f"No combination of the {len(pool)} matching pieces is within {tolerance} seconds of {format_duration(target)}."}), 422
+        pieces = order_without_repeated_composer(chosen) if no_repeat_composer else chosen
+        if pieces is not None:
+            break
+    if pieces is None:
+        return jsonify({"error": "Could not find a set without the same composer back-to-back. Try a wider tolerance or fewer filters."}), 422
+
+    total = sum(piece['seconds'] for piece in pieces)
+    songs = [{field: piece[field] for field in ('id', 'name', 'file_path', 'title', 'composer',
+                                                  'genre', 'key', 'difficulty', 'playtime')}
+             for piece in pieces]
+    result = {"target_duration": format_duration(target), "total_duration": format_duration(total),
+              "total_seconds": total, "candidate_count": len(pool), "songs": songs}
+
+    if name:
+        try:
+            cursor = db.cursor()
+            cursor.execute("INSERT INTO Playlist (name) VALUES (?)", (name,))
+            playlist_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO PlaylistSong (playlist_id, library_item_id, order_index) VALUES (?, ?, ?)",
+                               [(playlist_id, song['id'], order_index) for order_index, song in enumerate(songs)])
+            db.commit()
+        except sqlite3.IntegrityError:
+            db.rollback()
+            return jsonify({"error": "Playlist with this name already exists"}), 409
+        except sqlite3.Error as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 500
+        result.update({"id": playlist_id, "name": name})
+        return jsonify(result), 201
+
+    return jsonify(result), 200
+
+
+# --- Annotations and Reading Position ---
+
+# Stroke points are page-relative (0..1). They are stored as integers in units of
+# 1/ANNOTATION_COORDINATE_SCALE of the page, each point as the difference from the previous one,
+# which keeps the numbers small and lets zlib compress a page's strokes well.
+ANNOTATION_COORDINATE_SCALE = 10000
+
+# Stroke attributes kept besides 'id' and 'points', with the type each must have;
+# anything else sent by a client is dropped. Numbers must lie within the given (min, max).
+STROKE_ATTRIBUTES = {'tool': str, 'color': str, 'width': (0, 100), 'opacity': (0, 1)}
+
+# Upper bounds for one sync request, one page, one stroke and one text value (stroke ids, attributes, device ids)
+MAX_SYNC_CHANGES = 500
+MAX_STROKES_PER_PAGE = 5000
+MAX_POINTS_PER_STROKE = 5000
+MAX_ANNOTATION_TEXT_LENGTH = 64
+
+# Largest value SQLite stores as an INTEGER; larger item ids, pages or versions fail at binding
+MAX_SQLITE_INTEGER = 2**63 - 1
+
+# Tables holding per-item state that must follow the item's id. Entries for items that
+# disappear (rescan, storage root removal) are deleted along with them.
+ITEM_STATE_TABLES = ['Annotation', 'ReadingPosition']
+
+def is_valid_stroke_id(stroke_id):
+    """Stroke ids are integers or short strings."""
+    if isinstance(stroke_id, str):
+        return len(stroke_id) <= MAX_ANNOTATION_TEXT_LENGTH
+    return isinstance(stroke_id, int) and not isinstance(stroke_id, bool)
+
+def parse_sync_number(value, field):
+    """
+    Returns value if it is a whole JSON number from 1 to MAX_SQLITE_INTEGER (item ids, pages).
+    Raises ValueError otherwise; floats are refused rather than truncated.
+    """
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_SQLITE_INTEGER:
+        raise ValueError(f"'{field}' must be a whole number from 1 to {MAX_SQLITE_INTEGER}.")
+    return value
+
+def pack_stroke(stroke):
+    """
+    Validates a stroke from a client ({'id', 'points': [x0, y0, x1, y1, ...], ...attributes})
+    and returns its stored form with quantized, delta-encoded points.
+    Raises ValueError if the stroke is malformed.
+    """
+    if not isinstance(stroke, dict) or not is_valid_stroke_id(stroke.get('id')):
+        raise ValueError(f"Each stroke needs an 'id' (an integer or a string of at most {MAX_ANNOTATION_TEXT_LENGTH} characters).")
+    points = stroke.get('points')
+    if not isinstance(points, list) or len(points) % 2 != 0:
+        raise ValueError("Stroke 'points' must be a flat list of x, y pairs.")
+    if len(points) > 2 * MAX_POINTS_PER_STROKE:
+        raise ValueError(f"A stroke can have at most {MAX_POINTS_PER_STROKE} points.")
+    deltas = []
+    previous = [0, 0]
+    for position, value in enumerate(points):
+        # Points are page-relative; this also rules out infinities and NaN
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+            raise ValueError("Stroke points must be numbers between 0 and 1.")
+        quantized = round(value * ANNOTATION_COORDINATE_SCALE)
+        deltas.append(quantized - previous[position % 2])
+        previous[position % 2] = quantized
+    packed = {'id': stroke['id'], 'points': deltas}
+    for attribute, allowed in STROKE_ATTRIBUTES.items():
+        if attribute not in stroke:
+            continue
+        value = stroke[attribute]
+        if allowed is str:
+            valid = isinstance(value, str) and len(value) <= MAX_ANNOTATION_TEXT_LENGTH
+        else:
+            valid = not isinstance(value, bool) and isinstance(value, (int, float)) and allowed[0] <= value <= allowed[1]
+        if not valid:
+            raise ValueError(f"Invalid stroke '{attribute}'.")
+        packed[attribute] = value
+    return packed
+
+def unpack_stroke(packed):
+    """Turns a stored stroke back into the client form with page-relative points."""
+    stroke = dict(packed)
+    points = []
+    current = [0, 0]
+    for position, delta in enumerate(packed['points']):
+        current[position % 2] += delta
+        points.append(current[position % 2] / ANNOTATION_COORDINATE_SCALE)
+    stroke['points'] = points
+    return stroke
+
+def compress_strokes(packed_strokes):
+    """Serializes a page's stored strokes to the compressed blob kept in Annotation.strokes."""
+    return zlib.compress(json.dumps(packed_strokes, separators=(',', ':')).encode('utf-8'))
+
+def decompress_strokes(blob):
+    """Reads a page's stored strokes from its compressed blob."""
+    return json.loads(zlib.decompress(blob)) if blob else []
+
+def parse_page_list(text):
+    """
+    Parses a page selection such as '3', '3,4,7' or '3-6' (1-based pages).
+    Returns a sorted list of page numbers. Raises ValueError if the selection is invalid.
+    """
+    pages = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        if first < 1 or last < first or last - first >= 1000 or last > MAX_SQLITE_INTEGER:
+            raise ValueError(f"Invalid page range '{part}'.")
+        pages.update(range(first, last + 1))
+    return sorted(pages)
+
+def delete_item_state(cursor, condition, values=()):
+    """
+    Deletes annotations and reading positions whose entries match condition,
+    an SQL expression in which '{table}' stands for each state table in turn.
+    """
+    for table in ITEM_STATE_TABLES:
+        cursor.execute(f"DELETE FROM {table} WHERE " + condition.format(table=table), values)
+
+@app.route('/api/library/<int:item_id>/annotations', methods=['GET'])
+def get_library_item_annotations(item_id):
+    """
+    API endpoint to fetch a PDF's annotations for the pages being viewed, plus its last-viewed page.
+    Query parameters:
+      'pages' - pages to return, e.g. '3,4' or '3-6'. Without it only the position and version are returned.
+      'since' - only return pages changed after this item version (as returned by an earlier call).
+    Pages without annotations are omitted. A page cleared on another device is returned with no strokes.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        pages = parse_page_list(request.args.get('pages', ''))
+        since = int(request.args.get('since', 0))
+        if not 0 <= since <= MAX_SQLITE_INTEGER:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "Invalid 'pages' or 'since' parameter."}), 400
+
+    cursor.execute("SELECT type FROM LibraryItem WHERE id = ?", (item_id,))
+    item = cursor.fetchone()
+    if not item:
+        return jsonify({"error": "Item not found"}), 404
+    if item['type'] != 'pdf':
+        return jsonify({"error": "Only PDF items have annotations."}), 400
+
+    cursor.execute("SELECT MAX(version) FROM Annotation WHERE library_item_id = ?", (item_id,))
+    version = cursor.fetchone()[0] or 0
+
+    page_data = {}
+    if pages and version > since:
+        placeholders = ', '.join('?' for _ in pages)
+        cursor.execute(f"""
+            SELECT page, strokes, version, updated_at FROM Annotation
+            WHERE library_item_id = ? AND page IN ({placeholders}) AND version > ?
+        """, (item_id, *pages, since))
+        for row in cursor.fetchall():
+            page_data[str(row['page'])] = {
+                "version": row['version'],
+                "updated_at": row['updated_at'],
+                "strokes": [unpack_stroke(packed) for packed in decompress_strokes(row['strokes'])],
+            }
+
+    cursor.execute("SELECT page, updated_at, device_id FROM ReadingPosition WHERE library_item_id = ?", (item_id,))
+    position = cursor.fetchone()
+    return jsonify({
+        "item_id": item_id,
+        "version": version,
+        "last_page": dict(position) if position else None,
+        "pages": page_data,
+    }), 200
+
+@app.route('/api/annotations/sync', methods=['POST'])
+def sync_annotations():
+    """
+    API endpoint to upload annotation changes and page positions from a device in one batch.
+    JSON body:
+      'device_id' - optional name of the uploading device.
+      'changes'   - list of {'item_id', 'page', 'add': [strokes], 'remove': [stroke ids], 'clear': bool}.
+                    'clear' empties the page first; added strokes replace strokes with the same id.
+      'positions' - list of {'item_id', 'page'}: the last page viewed on each item.
+    Changes to the same page from different devices merge by stroke id, so nothing is lost
+    when tablets annotate the same score at once. Everything is applied in one transaction.
+    Returns a result per change (the page's new version) and per position, or an error for that entry.
+    """
+    db = get_db()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "The request body must be a JSON object."}), 400
+    device_id = data.get('device_id')
+    changes = data.get('changes') or []
+    positions = data.get('positions') or []
+
+    if device_id is not None and (not isinstance(device_id, str) or len(device_id) > MAX_ANNOTATION_TEXT_LENGTH):
+        return jsonify({"error": f"'device_id' must be a string of at most {MAX_ANNOTATION_TEXT_LENGTH} characters."}), 400
+
+    if not isinstance(changes, list) or not isinstance(positions, list):
+        return jsonify({"error": "'changes' and 'positions' must be lists."}), 400
+    if len(changes) + len(positions) > MAX_SYNC_CHANGES:
+        return jsonify({"error": f"At most {MAX_SYNC_CHANGES} changes and positions per request."}), 400
+
+    # Validate and pack everything before touching the database, so the write transaction stays short
+    change_results = []
+    planned_changes = []
+    for change in changes:
+        try:
+            if not isinstance(change, dict):
+                raise ValueError("Each change must be an object.")
+            item_id, page = parse_sync_number(change.get('item_id'), 'item_id'), parse_sync_number(change.get('page'), 'page')
+            added = change.get('add') or []
+            removed = change.get('remove') or []
+            # A string here would otherwise be taken apart into single characters
+            if not isinstance(added, list) or not isinstance(removed, list):
+                raise ValueError("'add' and 'remove' must be lists.")
+            if not all(is_valid_stroke_id(stroke_id) for stroke_id in removed):
+                raise ValueError("'remove' must list stroke ids.")
+            added = [pack_stroke(stroke) for stroke in added]
+            removed = set(removed)
+            planned_changes.append((len(change_results), item_id, page, added, removed, bool(change.get('clear'))))
+            change_results.append({"item_id": item_id, "page": page})
+        except (ValueError, TypeError) as e:
+            change_results.append({"item_id": change.get('item_id') if isinstance(change, dict) else None,
+                                   "error": str(e) if isinstance(e, ValueError) else "Invalid change."})
+
+    position_results = []
+    planned_positions = []
+    for position in positions:
+        try:
+            if not isinstance(position, dict):
+                raise ValueError("Each position must be an object.")
+            item_id, page = parse_sync_number(position.get('item_id'), 'item_id'), parse_sync_number(position.get('page'), 'page')
+            planned_positions.append((len(position_results), item_id, page))
+            position_results.append({"item_id": item_id, "page": page})
+        except ValueError as e:
+            position_results.append({"item_id": position.get('item_id') if isinstance(position, dict) else None,
+                                     "error": str(e)})
+
+    requested_ids = {entry[1] for entry in planned_changes} | {entry[1] for entry in planned_positions}
+    now_iso = datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+    try:
+        cursor = db.cursor()
+        # Taking the write lock up front keeps the read-merge-write of each page atomic across devices
+        cursor.execute("BEGIN IMMEDIATE")
+        known_ids = set()
+        if requested_ids:
+            id_list = list(requested_ids)
+            placeholders = ', '.join('?' for _ in id_list)
+            cursor.execute(f"SELECT id FROM LibraryItem WHERE type = 'pdf' AND id IN ({placeholders})", id_list)
+            known_ids = {row['id'] for row in cursor.fetchall()}
+
+        item_versions = {}
+        for result_index, item_id, page, added, removed, clear in planned_changes:
+            result = change_results[result_index]
+            if item_id not in known_ids:
+                result['error'] = "PDF item not found."
+                continue
+            if item_id not in item_versions:
+                cursor.execute("SELECT MAX(version) FROM Annotation WHERE library_item_id = ?", (item_id,))
+                item_versions[item_id] = cursor.fetchone()[0] or 0
+
+            cursor.execute("SELECT strokes FROM Annotation WHERE library_item_id = ? AND page = ?", (item_id, page))
+            row = cursor.fetchone()
+            strokes = {} if clear or not row else {packed['id']: packed for packed in decompress_strokes(row['strokes'])}
+            for stroke_id in removed:
+                strokes.pop(stroke_id, None)
+            for packed in added:
+                strokes[packed['id']] = packed
+            if len(strokes) > MAX_STROKES_PER_PAGE:
+                result['error'] = f"A page can hold at most {MAX_STROKES_PER_PAGE} strokes."
+                continue
+
+            item_versions[item_id] += 1
+            cursor.execute("""
+                INSERT OR REPLACE INTO Annotation (library_item_id, page, strokes, stroke_count, version, updated_at, device_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (item_id, page, compress_strokes(list(strokes.values())), len(strokes),
+                  item_versions[item_id], now_iso, device_id))
+            result['version'] = item_versions[item_id]
+
+        for result_index, item_id, page in planned_positions:
+            if item_id not in known_ids:
+                position_results[result_index]['error'] = "PDF item not found."
+                continue
+            cursor.execute("INSERT OR REPLACE INTO ReadingPosition (library_item_id, page, updated_at, device_id) VALUES (?, ?, ?, ?)",
+                           (item_id, page, now_iso, device_id))
+        db.commit()
+    except sqlite3.Error as e:
+        db.rollback()
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+    return jsonify({"changes": change_results, "positions": position_results}), 200
+
+
+# --- Offline Bundle Export ---
+
+# Size of the blocks used when hashing and streaming PDFs, so whole files are never held in memory
+BUNDLE_CHUNK_SIZE = 64 * 1024
+
+# Song fields that change whenever a score is opened. They are left out of the bundle's
+# playlist.json so that playing a song does not change the archive (and break resumed downloads).
+BUNDLE_EXCLUDED_SONG_FIELDS = ('date_last_played',)
+
+# Cache of content hashes keyed by absolute path: {abs_path: ((size, mtime_ns), sha256_hex)}
+# A file is only re-hashed when its size or modification time changes.
+_file_hash_cache = {}
+
+def get_file_sha256(abs_path, stat_result):
+    """
+    Returns the SHA-256 hex digest of a file, reading it in chunks.
+    Results are cached against the file's size and modification time.
+    """
+    signature = (stat_result.st_size, stat_result.st_mtime_ns)
+    cached = _file_hash_cache.get(abs_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(abs_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUNDLE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    sha256_hex = digest.hexdigest()
+    _file_hash_cache[abs_path] = (signature, sha256_hex)
+    return sha256_hex
+
+def build_playlist_manifest(playlist_dict):
+    """
+    Builds the bundle manifest for a playlist: one entry per PDF with its archive path,
+    size and content hash, plus the songs whose files are missing on the server.
+    Songs on a storage root known to be offline count as missing without touching the disk,
+    since a stat on an unmounted network share can hang.
+    Returns (manifest, files) where files maps archive paths to (abs_path, stat_result).
+    """
+    manifest = {
+        "playlist_id": playlist_dict['id'],
+        "name": playlist_dict['name'],
+        "files": [],
+        "missing": []
+    }
+    files = {}
+
+    for song in playlist_dict['songs']:
+        file_path = song.get('file_path')
+        abs_path = get_abs_path_for(file_path) if file_path and is_root_online(resolve_root(file_path)[0]) else None
+        try:
+            stat_result = os.stat(abs_path) if abs_path else None
+        except OSError:
+            stat_result = None
+
+        if stat_result is None:
+            manifest['missing'].append({"id": song['id'], "file_path": file_path})
+            continue
+
+        # Archive paths always use forward slashes, whatever the server's OS
+        archive_path = "pdfs/" + file_path.replace(os.sep, '/')
+        manifest['files'].append({
+            "id": song['id'],
+            "file_path": file_path,
+            "archive_path": archive_path,
+            "size": stat_result.st_size,
+            "sha256": get_file_sha256(abs_path, stat_result)
+        })
+        files[archive_path] = (abs_path, stat_result)
+
+    return manifest, files
+
+def make_tar_header(name, size, mtime):
+    """
+    Returns the tar header block(s) for a regular file member.
+    PAX format is used so long or non-ASCII score names survive intact.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+def build_bundle_segments(playlist_dict, manifest, files, have_hashes):
+    """
+    Lays out the tar archive as a list of segments without reading any PDF data.
+    Each segment is (length, data_bytes, abs_path); exactly one of data_bytes/abs_path is set.
+    Because every length is known up front, the archive size is known before streaming
+    and any byte offset can be served directly, which is what makes range requests cheap.
+    """
+    segments = []
+
+    def add_member(name, length, mtime, data_bytes=None, abs_path=None):
+        header = make_tar_header(name, length, mtime)
+        segments.append((len(header), header, None))
+        segments.append((length, data_bytes, abs_path))
+        padding = (-length) % tarfile.BLOCKSIZE
+        if padding:
+            segments.append((padding, b'\0' * padding, None))
+
+    # The metadata documents are fixed in content, so their mtime is fixed too (keeps the archive byte-stable)
+    bundle_playlist = dict(playlist_dict)
+    bundle_playlist['songs'] = [{field: value for field, value in song.items() if field not in BUNDLE_EXCLUDED_SONG_FIELDS}
+                                for song in playlist_dict['songs']]
+    playlist_json = json.dumps(bundle_playlist, indent=2).encode('utf-8')
+    manifest_json = json.dumps(manifest, indent=2).encode('utf-8')
+    add_member("playlist.json", len(playlist_json), 0, data_bytes=playlist_json)
+    add_member("manifest.json", len(manifest_json), 0, data_bytes=manifest_json)
+
+    for entry in manifest['files']:
+        # Skip files the client reports it already has
+        if entry['sha256'] in have_hashes:
+            continue
+        abs_path, stat_result = files[entry['archive_path']]
+        add_member(entry['archive_path'], stat_result.st_size, stat_result.st_mtime, abs_path=abs_path)
+
+    # A tar archive ends with two zero-filled blocks
+    end_of_archive = b'\0' * (2 * tarfile.BLOCKSIZE)
+    segments.append((len(end_of_archive), end_of_archive, None))
+    return segments
+
+def get_bundle_etag(segments, manifest, files):
+    """
+    Derives the ETag from the archive layout itself: the bytes of every header and metadata
+    document, and each PDF's length and content hash. It changes exactly when the bytes of
+    the archive would change, so If-Range only resumes a download of the same archive.
+    """
+    sha256_for_path = {files[entry['archive_path']][0]: entry['sha256'] for entry in manifest['files']}
+    hasher = hashlib.sha256()
+    for length, data_bytes, abs_path in segments:
+        hasher.update(str(length).encode('ascii'))
+        hasher.update(data_bytes if data_bytes is not None else sha256_for_path[abs_path].encode('ascii'))
+    return hasher.hexdigest()[:32]
+
+def iter_bundle_bytes(segments, start, stop):
+    """
+    Yields the archive bytes in the half-open range [start, stop), opening PDFs
+    only when their segment is reached and reading them in BUNDLE_CHUNK_SIZE blocks.
+    """
+    offset = 0
+    for length, data_bytes, abs_path in segments:
+        segment_start, segment_end = offset, offset + length
+        offset = segment_end
+        if segment_end <= start:
+            continue
+        if segment_start >= stop:
+            break
+
+        read_from = max(start, segment_start) - segment_start
+        read_to = min(stop, segment_end) - segment_start
+
+        if data_bytes is not None:
+            yield data_bytes[read_from:read_to]
+            continue
+
+        remaining = read_to - read_from
+        with open(abs_path, 'rb') as f:
+            f.seek(read_from)
+            while remaining > 0:
+                chunk = f.read(min(BUNDLE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    # The file shrank since the manifest was built. Zero-fill so the archive
+                    # framing stays valid; the manifest hash lets the client detect the mismatch.
+                    chunk = b'\0' * min(BUNDLE_CHUNK_SIZE, remaining)
+                remaining -= len(chunk)
+                yield chunk
+
+@app.route('/api/playlists/<int:playlist_id>/bundle/manifest', methods=['GET'])
+def get_playlist_bundle_manifest(playlist_id):
+    """
+    API endpoint to fetch the content-hash manifest for a playlist bundle.
+    Clients compare the hashes with what they already store and pass the ones they
+    have to the bundle endpoint via 'have', so only missing files are downloaded.
+    """
+    db = get_db()
+    playlist_dict = fetch_playlist_with_songs(db.cursor(), playlist_id)
+    if not playlist_dict:
+        return jsonify({"error": "Playlist not found"}), 404
+
+    try:
+        manifest, _ = build_playlist_manifest(playlist_dict)
+    except OSError as e:
+        return jsonify({"error": f"Server file system error: {str(e)}"}), 500
+    return jsonify(manifest), 200
+
+@app.route('/api/playlists/<int:playlist_id>/bundle', methods=['GET'])
+def get_playlist_bundle(playlist_id):
+    """
+    API endpoint to download a playlist as a single tar archive for offline use.
+    The archive holds playlist.json (as GET /api/playlists/<id>, minus per-play fields), manifest.json
+    and every referenced PDF under pdfs/. It is streamed straight from the files on disk.
+    Optional query parameter 'have' is a comma-separated list of SHA-256 hashes the client
+    already has; those PDFs are left out. Single byte ranges (with If-Range) are supported
+    so an interrupted download can be resumed.
+    """
+    db = get_db()
+    playlist_dict = fetch_playlist_with_songs(db.cursor(), playlist_id)
+    if not playlist_dict:
+        return jsonify({"error": "Playlist not found"}), 404
+
+    have_hashes = {h.strip().lower() for h in request.args.get('have', '').split(',') if h.strip()}
+
+    try:
+        manifest, files = build_playlist_manifest(playlist_dict)
+    except OSError as e:
+        return jsonify({"error": f"Server file system error: {str(e)}"}), 500
+
+    segments = build_bundle_segments(playlist_dict, manifest, files, have_hashes)
+    total_length = sum(length for length, _, _ in segments)
+
+    # The ETag identifies this exact archive layout (which also reflects 'have'), so a resumed
+    # download is only stitched together when nothing in the playlist or its files has changed.
+    etag = get_bundle_etag(segments, manifest, files)
+
+    start, stop, status = 0, total_length, 200
+    range_header = request.range
+    if_range = request.if_range
+    if_range_matches = (if_range.etag is None and if_range.date is None) or if_range.etag == etag
+    # Multi-range requests are answered with the full archive, which HTTP allows
+    if range_header and if_range_matches and len(range_header.ranges) == 1:
+        byte_range = range_header.range_for_length(total_length)
+        if byte_range is None:
+            response = jsonify({"error": "Requested range not satisfiable"})
+            response.status_code = 416
+            response.headers['Content-Range'] = f"bytes */{total_length}"
+            return response
+        start, stop = byte_range
+        status = 206
+
+    response = Response(iter_bundle_bytes(segments, start, stop), status=status,
+                        mimetype='application/x-tar', direct_passthrough=True)
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f'attachment; filename="playlist-{playlist_id}.tar"'
+    response.set_etag(etag)
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{total_length}"
+    return response
+
+
 # --- Frontend Routes ---
 
 # Set the root URL to serve library.html
@@ -866,6 +2938,88 @@ def get_server_address():
     return jsonify({"server_address": server_address})
 
 
+# --- Background Tasks ---
+
+def run_scan_scheduler():
+    """
+    Background loop: every SCAN_SCHEDULER_TICK seconds, refreshes the availability of every
+    storage root and scans the online roots whose scan_interval has elapsed.
+    Offline roots are skipped and keep their items.
+    """
+    started_at = time.time()
+    while True:
+        time.sleep(SCAN_SCHEDULER_TICK)
+        roots = list(STORAGE_ROOTS)
+        online = check_storage_roots(roots)
+        now = time.time()
+        due = [root['name'] for root in roots
+               if root['scan_interval'] > 0 and root['name'] in online
+               and now - ROOT_STATUS.get(root['name'], {}).get('last_scan', started_at) >= root['scan_interval']]
+        if not due:
+            continue
+        try:
+            with app.app_context():
+                scan_pdfs_and_populate_db(due)
+        except Exception as e:
+            print(f"Error during scheduled scan of {due}: {e}")
+
+def wait_for_server(port, timeout=SERVER_START_TIMEOUT):
+    """
+    Blocks until something accepts connections on the local port (or the timeout passes).
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def run_startup_tasks(port=None):
+    """
+    Work deferred from startup: scan an empty library. Given a port, waits until the server
+    is listening on it first; without one the server is already handling requests.
+    """
+    if port is not None:
+        wait_for_server(port)
+    scan_if_library_empty()
+
+# The background threads run once per process. Code that drives the app itself, such as
+# benchmark.py, switches them off so no scan starts behind its back.
+START_BACKGROUND_TASKS = True
+_background_tasks_pid = None
+_background_tasks_lock = threading.Lock()
+
+def start_background_tasks(port=None):
+    """
+    Starts the background threads, unless this process already has: the deferred startup
+    scan and the storage root scan scheduler.
+    """
+    global _background_tasks_pid
+    with _background_tasks_lock:
+        # Compared by pid, so a worker forked from a process that started them starts its own
+        if _background_tasks_pid == os.getpid():
+            return
+        _background_tasks_pid = os.getpid()
+    threading.Thread(target=run_startup_tasks, args=(port,), name='startup-tasks', daemon=True).start()
+    threading.Thread(target=run_scan_scheduler, name='scan-scheduler', daemon=True).start()
+
+def start_background_tasks_on_first_request():
+    """
+    Starts the background tasks from the first request a process handles, so they also run
+    under 'flask run', WSGI servers and app.run() without the reloader.
+    """
+    if START_BACKGROUND_TASKS and _background_tasks_pid != os.getpid():
+        start_background_tasks()
+
+app.before_request(start_background_tasks_on_first_request)
+
 # This block ensures the Flask development server runs only when the script is executed directly.
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)
+    # With debug=True the reloader runs this block in a watcher process and again in the
+    # serving process; only the serving process (WERKZEUG_RUN_MAIN set) starts the background
+    # tasks right away instead of on its first request.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks(SERVER_PORT)
+    app.run(host='0.0.0.0', port=SERVER_PORT, debug=True)
@@ -0,0 +1,849 @@
+"""
+Scale benchmark for the Sheet Pro Flask application.
+
+Generates a synthetic sheet music library (folders + PDFs) at one or more sizes,
+drives app.py through Flask's test client and reports throughput, latency
+percentiles and peak memory per operation as JSON. The 'startup' phase cold-starts
+app.py in a fresh interpreter and reports its import time with the slowest imports.
+The 'annotations' phase has several simulated tablets syncing annotations concurrently.
+The 'scan_edits' phase edits metadata during a rescan and fails if any edit is lost;
+'concurrent_scans' fails if a queued rescan slows down the one running, and
+'batch_checks' fails if a batch of renames and moves breaks a collision rule or
+leaves files moved after the database update fails.
+
+Usage examples:
+    python benchmark.py --sizes 1k 10k
+    python benchmark.py --sizes 100k --db-only --output bench_results.json
+    python benchmark.py --sizes 50k --db-only --phases setlist
+    python benchmark.py --sizes 1k --save-baseline bench_baseline.json
+    python benchmark.py --sizes 1k --baseline bench_baseline.json --fail-on-regression
+
+--db-only writes the synthetic library straight into the database instead of
+creating files, which makes 1M-item runs practical; the scan and PDF serving
+phases are skipped in that mode because they need real files.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A tiny but valid single-page PDF, written for every synthetic score
+MINIMAL_PDF = (
+    b"%PDF-1.4\n"
+    b"1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n"
+    b"%%EOF\n"
+)
+
+GENRES = ['Classical', 'Baroque', 'Romantic', 'Jazz', 'Worship', 'Hymns', 'Pop', 'Film', 'Folk', 'Musical Theatre']
+KEYS = ['C', 'G', 'D', 'A', 'E', 'B', 'F#', 'F', 'Bb', 'Eb', 'Ab', 'Db',
+        'Am', 'Em', 'Bm', 'F#m', 'C#m', 'G#m', 'Dm', 'Gm', 'Cm', 'Fm', 'Bbm', 'Ebm']
+
+# Fraction of generated items that are folders, and the deepest folder level below Root
+FOLDER_RATIO = 0.05
+MAX_FOLDER_DEPTH = 5
+
+# Default number of timed operations per phase (the scan runs once per size)
+DEFAULT_REPEATS = {
+    'scan': 1,
+    'library': 5,
+    'playlist_crud': 20,
+    'reorder': 20,
+    'metadata': 200,
+    'serve_pdf': 200,
+    'startup': 5,
+    'setlist': 50,
+    'annotations': 400,
+    'batch_move': 5,
+    'scan_edits': 50,
+    'concurrent_scans': 2,
+    'batch_checks': 3,
+}
+
+# Two overlapping rescans run one after the other, so together they should take about twice
+# as long as one; the 'concurrent_scans' phase fails beyond this factor (plus a second of slack)
+CONCURRENT_SCAN_SLOWDOWN_LIMIT = 3
+
+# Scores moved by each request of the 'batch_move' phase
+BATCH_MOVE_SIZE = 200
+
+# Simulated tablets annotating at once in the 'annotations' phase, and the shape of their uploads
+ANNOTATION_DEVICES = 8
+ANNOTATION_SCORES = 20
+ANNOTATION_PAGES_PER_SYNC = 4
+ANNOTATION_STROKES_PER_PAGE = 3
+ANNOTATION_POINTS_PER_STROKE = 40
+
+# Run in a fresh interpreter to time a cold import of app.py (which includes init_db)
+STARTUP_SCRIPT = (
+    "import time; started = time.perf_counter(); import app; "
+    "print('APP_IMPORT_MS', (time.perf_counter() - started) * 1000)"
+)
+
+# Number of slowest imports listed in the startup report
+STARTUP_REPORT_TOP_IMPORTS = 10
+
+def log(message):
+    """Progress output goes to stderr so stdout can carry the JSON report."""
+    print(message, file=sys.stderr, flush=True)
+
+def parse_size(text):
+    """Parses sizes such as '1000', '10k' or '1m' into an item count."""
+    text = text.strip().lower()
+    multiplier = 1
+    if text.endswith('k'):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith('m'):
+        multiplier, text = 1000000, text[:-1]
+    return int(float(text) * multiplier)
+
+# --- Synthetic Library Generation ---
+
+def generate_layout(item_count, rng):
+    """
+    Plans a synthetic library of roughly item_count items.
+    Returns (folders, pdfs): folders is a list of '/'-separated relative paths (parents first),
+    pdfs is a list of dicts with the relative path and the metadata used by the benchmark.
+    """
+    folder_count = max(1, int(item_count * FOLDER_RATIO))
+    pdf_count = max(1, item_count - folder_count)
+
+    # Top level is one folder per genre; deeper folders attach to a random existing folder,
+    # which gives the shallow-heavy, long-tailed depth distribution of real libraries.
+    folders = []
+    depth_of = {}
+    genre_of = {}
+    for genre in GENRES[:folder_count]:
+        folders.append(genre)
+        depth_of[genre] = 1
+        genre_of[genre] = genre
+    while len(folders) < folder_count:
+        parent = rng.choice(folders)
+        if depth_of[parent] >= MAX_FOLDER_DEPTH:
+            continue
+        path = f"{parent}/Collection {len(folders)}"
+        folders.append(path)
+        depth_of[path] = depth_of[parent] + 1
+        genre_of[path] = genre_of[parent]
+
+    composer_pool = [f"Composer {i}" for i in range(max(50, pdf_count // 50))]
+    pdfs = []
+    for i in range(pdf_count):
+        folder = rng.choice(folders)
+        # Zipf-like composer popularity: a few composers account for most scores
+        composer = composer_pool[min(int(rng.paretovariate(1.2)) - 1, len(composer_pool) - 1)]
+        minutes, seconds = divmod(rng.randint(90, 720), 60)
+        pdfs.append({
+            'path': f"{folder}/{composer} - Piece {i}.pdf",
+            'composer': composer,
+            'genre': genre_of[folder],
+            'key': rng.choice(KEYS),
+            'difficulty': str(rng.randint(1, 5)),
+            'playtime': f"{minutes:02d}:{seconds:02d}",
+        })
+    return folders, pdfs
+
+def write_library_files(library_dir, folders, pdfs):
+    """Creates the folder tree and a minimal PDF for every planned score."""
+    for folder in folders:
+        os.makedirs(os.path.join(library_dir, *folder.split('/')), exist_ok=True)
+    for pdf in pdfs:
+        with open(os.path.join(library_dir, *pdf['path'].split('/')), 'wb') as f:
+            f.write(MINIMAL_PDF)
+
+def insert_library_rows(db, folders, pdfs):
+    """
+    Writes the planned library straight into LibraryItem, mirroring what the scanner
+    stores, for --db-only runs where creating files would dominate the run time.
+    """
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+    cursor = db.cursor()
+    id_of = {'': 1}
+    for folder in folders:
+        parent, _, name = folder.rpartition('/')
+        cursor.execute("""
+            INSERT INTO LibraryItem (name, type, parent_id, pdf_url, date_created, date_last_played, path)
+            VALUES (?, 'folder', ?, NULL, ?, ?, ?)
+        """, (name, id_of[parent], now, now, folder))
+        id_of[folder] = cursor.lastrowid
+    cursor.executemany("""
+        INSERT INTO LibraryItem (name, type, parent_id, pdf_url, date_created, date_last_played, path, size)
+        VALUES (?, 'pdf', ?, ?, ?, ?, ?, ?)
+    """, [(pdf['path'].rpartition('/')[2], id_of[pdf['path'].rpartition('/')[0]],
+           pdf['path'].replace('/', os.sep), now, now, pdf['path'], len(MINIMAL_PDF)) for pdf in pdfs])
+    db.commit()
+
+def apply_metadata(db, pdfs):
+    """Stores the synthetic metadata (composer, genre, key, difficulty, playtime) by pdf_url."""
+    db.executemany("""
+        UPDATE LibraryItem SET composer = ?, genre = ?, key = ?, difficulty = ?, playtime = ?
+        WHERE pdf_url = ?
+    """, [(pdf['composer'], pdf['genre'], pdf['key'], pdf['difficulty'], pdf['playtime'],
+           pdf['path'].replace('/', os.sep)) for pdf in pdfs])
+    db.commit()
+
+def create_playlists(db, rng, item_count):
+    """
+    Creates playlists with a long-tailed size distribution (most short, a few very long),
+    one playlist per 200 items, between 3 and 500 playlists.
+    """
+    song_ids = [row[0] for row in db.execute("SELECT id FROM LibraryItem WHERE type = 'pdf'")]
+    cursor = db.cursor()
+    playlist_count = min(500, max(3, item_count // 200))
+    for i in range(playlist_count):
+        cursor.execute("INSERT INTO Playlist (name) VALUES (?)", (f"Benchmark Set {i}",))
+        playlist_id = cursor.lastrowid
+        size = min(len(song_ids), 200, int(rng.paretovariate(1.0) * 8))
+        cursor.executemany(
+            "INSERT INTO PlaylistSong (playlist_id, library_item_id, order_index) VALUES (?, ?, ?)",
+            [(playlist_id, song_id, index) for index, song_id in enumerate(rng.sample(song_ids, size))])
+    db.commit()
+    return playlist_count
+
+# --- Measurement ---
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies, elapsed):
+    """Turns per-operation latencies (seconds) into the JSON summary for one phase."""
+    ordered = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'ops': len(ordered),
+        'seconds': round(elapsed, 4),
+        'throughput_ops_per_sec': round(len(ordered) / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': {
+            'p50': to_ms(percentile(ordered, 0.50)),
+            'p90': to_ms(percentile(ordered, 0.90)),
+            'p95': to_ms(percentile(ordered, 0.95)),
+            'p99': to_ms(percentile(ordered, 0.99)),
+            'max': to_ms(ordered[-1] if ordered else None),
+        },
+    }
+
+def timed_request(client, method, url, expected_status, **kwargs):
+    """Issues one request through the test client and returns its latency in seconds."""
+    start = time.perf_counter()
+    response = client.open(url, method=method, **kwargs)
+    response.get_data() # Drain streamed bodies so serving cost is included
+    elapsed = time.perf_counter() - start
+    if response.status_code not in expected_status:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return elapsed
+
+class BenchmarkContext:
+    """State shared by the phases of one library size."""
+
+    def __init__(self, sheet_app, client, db_path, pdf_paths, rng):
+        self.sheet_app = sheet_app
+        self.client = client
+        self.db_path = db_path
+        self.pdf_paths = pdf_paths
+        self.rng = rng
+        self.counter = 0
+        # Extra per-phase report fields, merged into the phase's result
+        self.phase_details = {}
+
+    def query(self, sql, params=()):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+            return db.execute(sql, params).fetchall()
+
+    def random_pdf_ids(self, count):
+        rows = self.query("SELECT id FROM LibraryItem WHERE type = 'pdf' ORDER BY random() LIMIT ?", (count,))
+        return [row[0] for row in rows]
+
+# Each phase runs `repeats` operations and returns their latencies in seconds
+
+def phase_scan(ctx, repeats):
+    return [timed_request(ctx.client, 'POST', '/api/rescan_library', (200,)) for _ in range(repeats)]
+
+def phase_library(ctx, repeats):
+    return [timed_request(ctx.client, 'GET', '/api/library', (200,)) for _ in range(repeats)]
+
+def phase_playlist_crud(ctx, repeats):
+    latencies = []
+    song_ids = ctx.random_pdf_ids(10)
+    for _ in range(repeats):
+        ctx.counter += 1
+        start = time.perf_counter()
+        response = ctx.client.post('/api/playlists', json={'name': f"CRUD Playlist {ctx.counter}"})
+        latencies.append(time.perf_counter() - start)
+        playlist_id = response.get_json()['id']
+        for song_id in song_ids:
+            latencies.append(timed_request(ctx.client, 'POST', f'/api/playlists/{playlist_id}/songs', (201,),
+                                           json={'library_item_id': song_id}))
+        latencies.append(timed_request(ctx.client, 'GET', '/api/playlists', (200,)))
+        latencies.append(timed_request(ctx.client, 'GET', f'/api/playlists/{playlist_id}', (200,)))
+        latencies.append(timed_request(ctx.client, 'DELETE', f'/api/playlists/{playlist_id}/songs/{song_ids[0]}', (200,)))
+        latencies.append(timed_request(ctx.client, 'DELETE', f'/api/playlists/{playlist_id}', (200,)))
+    return latencies
+
+def phase_reorder(ctx, repeats):
+    # Reorder the longest playlist, which is the worst case for the per-row UPDATEs
+    playlist_id = ctx.query("""
+        SELECT playlist_id FROM PlaylistSong GROUP BY playlist_id ORDER BY COUNT(*) DESC LIMIT 1
+    """)[0][0]
+    song_ids = [row[0] for row in ctx.query(
+        "SELECT library_item_id FROM PlaylistSong WHERE playlist_id = ?", (playlist_id,))]
+    latencies = []
+    for _ in range(repeats):
+        ctx.rng.shuffle(song_ids)
+        latencies.append(timed_request(ctx.client, 'POST', f'/api/playlists/{playlist_id}/reorder', (200,),
+                                       json={'new_order': song_ids}))
+    return latencies
+
+def phase_metadata(ctx, repeats):
+    latencies = []
+    for item_id in ctx.random_pdf_ids(repeats):
+        minutes, seconds = divmod(ctx.rng.randint(90, 720), 60)
+        latencies.append(timed_request(ctx.client, 'POST', f'/api/library/{item_id}/metadata', (200,), json={
+            'title': f"Retitled {item_id}",
+            'rating': str(ctx.rng.randint(1, 5)),
+            'playtime': f"{minutes:02d}:{seconds:02d}",
+        }))
+    return latencies
+
+def phase_setlist(ctx, repeats):
+    # A mix of filter combinations; with no filter the whole library is the candidate pool
+    filter_choices = [
+        lambda: {},
+        lambda: {'genre': ctx.rng.choice(GENRES)},
+        lambda: {'key': ctx.rng.sample(KEYS, 3)},
+        lambda: {'difficulty_min': 2, 'difficulty_max': 4},
+        lambda: {'exclude_played_within_days': 30},
+    ]
+    latencies = []
+    for i in range(repeats):
+        minutes = ctx.rng.randint(20, 90)
+        body = {'target_duration': f"{minutes}:00", 'no_repeat_composer': i % 2 == 0, 'seed': i}
+        body.update(ctx.rng.choice(filter_choices)())
+        # 422 is a valid answer when the filters leave no set that fits
+        latencies.append(timed_request(ctx.client, 'POST', '/api/playlists/generate', (200, 422), json=body))
+    # The first request after the library changed includes building the candidate index
+    if latencies and 'setlist' not in ctx.phase_details:
+        ctx.phase_details['setlist'] = {'first_request_ms': round(latencies[0] * 1000, 3)}
+    return latencies
+
+def phase_scan_edits(ctx, repeats):
+    # Edits metadata while a rescan runs in the background, then checks that every edit
+    # survived the swap. Latencies show how long an edit waits on the scan's write lock.
+    item_ids = ctx.random_pdf_ids(repeats)
+    scan_errors = []
+
+    def run_scan():
+        try:
+            timed_request(ctx.client.application.test_client(), 'POST', '/api/rescan_library', (200,))
+        except Exception as e:
+            scan_errors.append(e)
+
+    scan_thread = threading.Thread(target=run_scan)
+    scan_thread.start()
+    latencies = []
+    edited = {}
+    for item_id in item_ids:
+        if not scan_thread.is_alive() and latencies:
+            break
+        composer = f"Edited during scan {ctx.rng.randint(0, 10**9)}"
+        latencies.append(timed_request(ctx.client, 'POST', f'/api/library/{item_id}/metadata', (200,),
+                                       json={'composer': composer}))
+        edited[item_id] = composer
+    scan_thread.join()
+    if scan_errors:
+        raise scan_errors[0]
+
+    placeholders = ', '.join('?' for _ in edited)
+    stored = dict(ctx.query(f"SELECT id, composer FROM LibraryItem WHERE id IN ({placeholders})", list(edited)))
+    lost = [item_id for item_id, composer in edited.items() if stored.get(item_id) != composer]
+    if lost:
+        raise RuntimeError(f"{len(lost)} of {len(edited)} metadata edits made during the scan were lost")
+    return latencies
+
+def phase_concurrent_scans(ctx, repeats):
+    # Times two rescans started together, checking the queued one does not slow the running one down
+    single_scan = timed_request(ctx.client, 'POST', '/api/rescan_library', (200,))
+    latencies = []
+    for _ in range(repeats):
+        errors = []
+
+        def run_scan():
+            try:
+                timed_request(ctx.client.application.test_client(), 'POST', '/api/rescan_library', (200,))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_scan) for _ in range(2)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+        if elapsed > CONCURRENT_SCAN_SLOWDOWN_LIMIT * single_scan + 1:
+            raise RuntimeError(f"Two concurrent rescans took {elapsed:.2f}s; a single rescan takes {single_scan:.2f}s")
+        latencies.append(elapsed)
+    ctx.phase_details['concurrent_scans'] = {'single_scan_ms': round(single_scan * 1000, 3)}
+    return latencies
+
+def phase_batch_move(ctx, repeats):
+    # Each repeat moves a batch of scores into one genre folder and then back where they came from,
+    # so the library (and the paths other phases serve) is unchanged afterwards
+    target_id = ctx.query("SELECT id FROM LibraryItem WHERE type = 'folder' AND parent_id = 1 ORDER BY id LIMIT 1")[0][0]
+    latencies = []
+    for _ in range(repeats):
+        item_ids = ctx.random_pdf_ids(BATCH_MOVE_SIZE)
+        placeholders = ', '.join('?' for _ in item_ids)
+        parent_of = dict(ctx.query(f"SELECT id, parent_id FROM LibraryItem WHERE id IN ({placeholders})", item_ids))
+        for operations in ([{'op': 'move', 'item_id': item_id, 'target_folder_id': target_id} for item_id in item_ids],
+                           [{'op': 'move', 'item_id': item_id, 'target_folder_id': parent_of[item_id]} for item_id in item_ids]):
+            latencies.append(timed_request(ctx.client, 'POST', '/api/library/batch', (200,), json={'operations': operations}))
+    return latencies
+
+def run_checked_batch(ctx, operations, expected):
+    """
+    Sends one batch and checks each operation's status against expected, a list of
+    'done'/'failed' with the start of the error message ('failed: Overlaps').
+    Returns the request's latency.
+    """
+    start = time.perf_counter()
+    response = ctx.client.post('/api/library/batch', json={'operations': operations})
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"Batch returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    for result, expectation in zip(response.get_json()['results'], expected):
+        status, _, error_start = expectation.partition(': ')
+        if result['status'] != status or not result.get('error', '').startswith(error_start):
+            raise RuntimeError(f"Batch operation {operations[result['index']]} gave {result}, expected {expectation!r}")
+    return elapsed
+
+def pick_sibling_pdfs(ctx):
+    """Two PDFs in the same folder (not Root), as (id, name, parent_id, path) rows."""
+    for item_id in ctx.random_pdf_ids(50):
+        rows = ctx.query("SELECT id, name, parent_id, path FROM LibraryItem WHERE type = 'pdf' AND parent_id = "
+                         "(SELECT parent_id FROM LibraryItem WHERE id = ?) AND parent_id != 1 ORDER BY id = ? DESC LIMIT 2",
+                         (item_id, item_id))
+        if len(rows) == 2:
+            return rows
+    raise RuntimeError("No folder holds two PDFs; the library is too small for 'batch_checks'")
+
+def phase_batch_checks(ctx, repeats):
+    # Checks the batch planner's collision rules and the undo of disk renames when the database
+    # update fails. Every change is reverted, so the library is unchanged afterwards.
+    sheet_app = ctx.sheet_app
+    latencies = []
+    for _ in range(repeats):
+        (first_id, first_name, folder_id, first_path), (second_id, second_name, _, _) = pick_sibling_pdfs(ctx)
+        checked_name = f"batch check {ctx.rng.randint(0, 10**9)}.pdf"
+        restore = {'op': 'rename', 'item_id': first_id, 'new_name': first_name}
+
+        # A path that another item in the library already has
+        latencies.append(run_checked_batch(ctx, [{'op': 'rename', 'item_id': first_id, 'new_name': second_name}],
+                                           ['failed: An item named']))
+        # Two operations giving different items the same path
+        latencies.append(run_checked_batch(ctx, [{'op': 'rename', 'item_id': first_id, 'new_name': checked_name},
+                                                 {'op': 'rename', 'item_id': second_id, 'new_name': checked_name}],
+                                           ['done', 'failed: Another operation']))
+        latencies.append(run_checked_batch(ctx, [restore], ['done']))
+        # An item and the folder holding it, in one batch
+        latencies.append(run_checked_batch(ctx, [{'op': 'rename', 'item_id': first_id, 'new_name': checked_name},
+                                                 {'op': 'rename', 'item_id': folder_id, 'new_name': checked_name}],
+                                           ['done', 'failed: Overlaps']))
+        latencies.append(run_checked_batch(ctx, [restore], ['done']))
+
+        # A failing database update must put the renamed file back on disk
+        def fail_rewrite(cursor, old_path, new_path):
+            raise sqlite3.OperationalError("simulated failure")
+        original_rewrite = sheet_app.rewrite_subtree_paths
+        sheet_app.rewrite_subtree_paths = fail_rewrite
+        try:
+            latencies.append(run_checked_batch(ctx, [{'op': 'rename', 'item_id': first_id, 'new_name': checked_name}],
+                                               ['failed: Database error']))
+        finally:
+            sheet_app.rewrite_subtree_paths = original_rewrite
+        checked_path = first_path.rpartition('/')[0] + '/' + checked_name
+        if not os.path.exists(sheet_app.get_abs_path_for(first_path)) or os.path.exists(sheet_app.get_abs_path_for(checked_path)):
+            raise RuntimeError(f"'{first_path}' was not moved back on disk after the database update failed")
+        if ctx.query("SELECT path FROM LibraryItem WHERE id = ?", (first_id,))[0][0] != first_path:
+            raise RuntimeError(f"Item {first_id} changed in the database although its batch failed")
+    return latencies
+
+def make_stroke(rng, stroke_id):
+    """A pen stroke wandering across the page, with page-relative points."""
+    x, y = rng.random(), rng.random()
+    points = []
+    for _ in range(ANNOTATION_POINTS_PER_STROKE):
+        x = min(1.0, max(0.0, x + rng.uniform(-0.01, 0.01)))
+        y = min(1.0, max(0.0, y + rng.uniform(-0.01, 0.01)))
+        points.extend((x, y))
+    return {'id': stroke_id, 'tool': 'pen', 'color': '#d32f2f', 'width': 2, 'points': points}
+
+def phase_annotations(ctx, repeats):
+    # Devices share a small set of scores so their writes contend for the same pages, as in a rehearsal.
+    # Each device alternates uploading a batch of strokes with fetching the pages it is viewing.
+    item_ids = ctx.random_pdf_ids(ANNOTATION_SCORES)
+    device_count = min(ANNOTATION_DEVICES, repeats)
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def run_device(device, operations, seed):
+        client = ctx.client.application.test_client()
+        rng = random.Random(seed)
+        device_latencies = []
+        try:
+            for i in range(operations):
+                item_id = rng.choice(item_ids)
+                first_page = rng.randint(1, 20)
+                pages = range(first_page, first_page + ANNOTATION_PAGES_PER_SYNC)
+                if i % 2 == 0:
+                    changes = [{'item_id': item_id, 'page': page,
+                                'add': [make_stroke(rng, f"d{device}-{i}-{page}-{n}") for n in range(ANNOTATION_STROKES_PER_PAGE)]}
+                               for page in pages]
+                    device_latencies.append(timed_request(client, 'POST', '/api/annotations/sync', (200,), json={
+                        'device_id': f"tablet-{device}", 'changes': changes,
+                        'positions': [{'item_id': item_id, 'page': first_page}]}))
+                else:
+                    device_latencies.append(timed_request(client, 'GET', f'/api/library/{item_id}/annotations?pages={first_page}-{pages[-1]}', (200,)))
+        except Exception as e:
+            with lock:
+                failures.append(e)
+        with lock:
+            latencies.extend(device_latencies)
+
+    threads = [threading.Thread(target=run_device,
+                                args=(device, repeats // device_count + (device < repeats % device_count), ctx.rng.random()))
+               for device in range(device_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+
+    stored = ctx.query("SELECT COALESCE(SUM(stroke_count), 0), COALESCE(SUM(LENGTH(strokes)), 0) FROM Annotation")[0]
+    ctx.phase_details['annotations'] = {
+        'devices': device_count,
+        'strokes_stored': stored[0],
+        'stored_bytes_per_stroke': round(stored[1] / stored[0], 1) if stored[0] else None,
+    }
+    return latencies
+
+def phase_serve_pdf(ctx, repeats):
+    paths = [ctx.rng.choice(ctx.pdf_paths) for _ in range(repeats)]
+    return [timed_request(ctx.client, 'GET', f'/local_pdfs/{path}', (200,)) for path in paths]
+
+def run_cold_start(db_path, import_time=False):
+    """
+    Imports app.py in a new interpreter, in a scratch directory holding a copy of db_path
+    as maestro_score.db. Returns (wall seconds, in-process import ms, stderr).
+    """
+    start_dir = tempfile.mkdtemp(prefix='sheet_pro_startup_')
+    try:
+        # The backup API also copies pages still sitting in the WAL file
+        with contextlib.closing(sqlite3.connect(db_path)) as source, \
+             contextlib.closing(sqlite3.connect(os.path.join(start_dir, 'maestro_score.db'))) as target:
+            source.backup(target)
+        command = [sys.executable] + (['-X', 'importtime'] if import_time else []) + ['-c', STARTUP_SCRIPT]
+        env = dict(os.environ, PYTHONPATH=REPO_DIR)
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=start_dir, env=env, capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(start_dir, ignore_errors=True)
+
+    app_import_ms = None
+    for line in completed.stdout.splitlines():
+        if line.startswith('APP_IMPORT_MS'):
+            app_import_ms = float(line.split()[1])
+    return elapsed, app_import_ms, completed.stderr
+
+def parse_import_times(importtime_output):
+    """Returns the slowest imports from `python -X importtime` output, by cumulative time."""
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue # Header line
+        imports.append({
+            'module': fields[2].strip(),
+            'self_ms': round(int(fields[0]) / 1000, 2),
+            'cumulative_ms': round(int(fields[1]) / 1000, 2),
+        })
+    imports.sort(key=lambda entry: entry['cumulative_ms'], reverse=True)
+    return imports[:STARTUP_REPORT_TOP_IMPORTS]
+
+def phase_startup(ctx, repeats):
+    # Wall time covers interpreter start, imports and init_db, i.e. the time before the app can serve
+    latencies = []
+    app_import_ms = []
+    for _ in range(repeats):
+        elapsed, import_ms, _ = run_cold_start(ctx.db_path)
+        latencies.append(elapsed)
+        app_import_ms.append(import_ms)
+    # One extra run with -X importtime for the per-module breakdown (its overhead is kept out of the timings)
+    _, _, importtime_output = run_cold_start(ctx.db_path, import_time=True)
+    ctx.phase_details['startup'] = {
+        'app_import_ms_p50': round(sorted(app_import_ms)[len(app_import_ms) // 2], 2) if app_import_ms else None,
+        'slowest_imports': parse_import_times(importtime_output),
+    }
+    return latencies
+
+PHASES = {
+    'scan': phase_scan,
+    'library': phase_library,
+    'playlist_crud': phase_playlist_crud,
+    'reorder': phase_reorder,
+    'metadata': phase_metadata,
+    'serve_pdf': phase_serve_pdf,
+    'startup': phase_startup,
+    'setlist': phase_setlist,
+    'annotations': phase_annotations,
+    'batch_move': phase_batch_move,
+    'scan_edits': phase_scan_edits,
+    'concurrent_scans': phase_concurrent_scans,
+    'batch_checks': phase_batch_checks,
+}
+
+# Phases that need real files on disk
+FILE_PHASES = {'scan', 'serve_pdf', 'batch_move', 'scan_edits', 'concurrent_scans', 'batch_checks'}
+
+# Phases that run outside this process, so tracemalloc cannot see their memory
+NO_MEMORY_PHASES = {'startup'}
+
+def run_phase(name, ctx, repeats, measure_memory):
+    """
+    Runs a phase once for timing and, optionally, once more (a single operation)
+    under tracemalloc for peak memory, so tracing overhead never skews the latencies.
+    """
+    start = time.perf_counter()
+    latencies = PHASES[name](ctx, repeats)
+    result = summarize(latencies, time.perf_counter() - start)
+    result.update(ctx.phase_details.pop(name, {}))
+
+    if measure_memory and name not in NO_MEMORY_PHASES:
+        tracemalloc.start()
+        try:
+            PHASES[name](ctx, 1)
+            result['peak_memory_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+# --- Driver ---
+
+def import_app(work_dir):
+    """
+    Imports app.py with work_dir as the current directory, so the database that
+    init_db() creates at import time lands in the scratch area, not the repository.
+    """
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        sys.path.insert(0, REPO_DIR)
+        import app as sheet_app
+    finally:
+        os.chdir(previous_dir)
+    # The phases decide when scans run; a startup scan or scheduled scan would skew their timings
+    sheet_app.START_BACKGROUND_TASKS = False
+    return sheet_app
+
+def prepare_database(sheet_app, db_path):
+    """Points the app at a fresh database and creates its schema without scanning."""
+    sheet_app.DATABASE = db_path
+    sheet_app.set_primary_storage_path(None)
+    with sheet_app.app.app_context():
+        sheet_app.init_db()
+        sheet_app.close_db()
+
+def benchmark_size(sheet_app, item_count, args, work_dir):
+    """Generates one library size and runs every selected phase against it."""
+    rng = random.Random(args.seed)
+    size_dir = os.path.join(work_dir, f"size_{item_count}")
+    library_dir = os.path.join(size_dir, 'library')
+    os.makedirs(library_dir)
+    db_path = os.path.join(size_dir, 'bench.db')
+
+    log(f"[{item_count}] generating layout...")
+    folders, pdfs = generate_layout(item_count, rng)
+
+    prepare_database(sheet_app, db_path)
+    start = time.perf_counter()
+    if args.db_only:
+        with contextlib.closing(sqlite3.connect(db_path)) as db:
+            insert_library_rows(db, folders, pdfs)
+    else:
+        write_library_files(library_dir, folders, pdfs)
+    log(f"[{item_count}] generated {len(folders)} folders and {len(pdfs)} PDFs in {time.perf_counter() - start:.1f}s")
+
+    sheet_app.set_primary_storage_path(library_dir)
+    client = sheet_app.app.test_client()
+    ctx = BenchmarkContext(sheet_app, client, db_path, [pdf['path'] for pdf in pdfs], rng)
+
+    phases = [name for name in args.phases if not (args.db_only and name in FILE_PHASES)]
+    results = {}
+
+    # The scan (if selected) runs first because it builds the library everything else uses
+    if 'scan' in phases:
+        log(f"[{item_count}] phase scan...")
+        results['scan'] = run_phase('scan', ctx, args.repeats.get('scan', DEFAULT_REPEATS['scan']), args.memory)
+    elif not args.db_only:
+        timed_request(client, 'POST', '/api/rescan_library', (200,))
+
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        apply_metadata(db, pdfs)
+        playlist_count = create_playlists(db, rng, item_count)
+    # The rows above were written behind the app's back, so its cached views must be rebuilt
+    sheet_app.bump_library_generation()
+
+    for name in phases:
+        if name == 'scan':
+            continue
+        log(f"[{item_count}] phase {name}...")
+        results[name] = run_phase(name, ctx, args.repeats.get(name, DEFAULT_REPEATS.get(name, 20)), args.memory)
+
+    return {
+        'items': len(folders) + len(pdfs),
+        'folders': len(folders),
+        'pdfs': len(pdfs),
+        'playlists': playlist_count,
+        'db_only': args.db_only,
+        'phases': results,
+    }
+
+def compare_with_baseline(current, baseline, threshold):
+    """
+    Compares p50/p95 latency, throughput and peak memory per size and phase.
+    A metric regresses when it is worse than the baseline by more than `threshold` (a fraction).
+    """
+    comparison = {}
+    regressions = []
+    for size, size_result in current['results'].items():
+        baseline_size = baseline.get('results', {}).get(size)
+        if not baseline_size:
+            continue
+        for phase, phase_result in size_result['phases'].items():
+            baseline_phase = baseline_size['phases'].get(phase)
+            if not baseline_phase:
+                continue
+            metrics = {
+                'p50_ms': (phase_result['latency_ms']['p50'], baseline_phase['latency_ms']['p50'], True),
+                'p95_ms': (phase_result['latency_ms']['p95'], baseline_phase['latency_ms']['p95'], True),
+                'throughput_ops_per_sec': (phase_result['throughput_ops_per_sec'], baseline_phase['throughput_ops_per_sec'], False),
+                'peak_memory_kb': (phase_result.get('peak_memory_kb'), baseline_phase.get('peak_memory_kb'), True),
+            }
+            phase_comparison = {}
+            for metric, (value, baseline_value, lower_is_better) in metrics.items():
+                if not value or not baseline_value:
+                    continue
+                change = (value - baseline_value) / baseline_value
+                regressed = change > threshold if lower_is_better else change < -threshold
+                phase_comparison[metric] = {
+                    'baseline': baseline_value,
+                    'current': value,
+                    'change_pct': round(change * 100, 1),
+                    'regression': regressed,
+                }
+                if regressed:
+                    regressions.append(f"{size}/{phase}/{metric}")
+            comparison.setdefault(size, {})[phase] = phase_comparison
+    return {'threshold_pct': threshold * 100, 'regressions': regressions, 'details': comparison}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Sheet Pro scale benchmark")
+    parser.add_argument('--sizes', nargs='+', default=['1k'], help="Library sizes, e.g. 1k 10k 100k 1m")
+    parser.add_argument('--phases', nargs='+', default=list(PHASES), choices=list(PHASES), help="Phases to run")
+    parser.add_argument('--repeat', action='append', default=[], metavar='PHASE=N',
+                        help="Override the number of operations for a phase, e.g. --repeat library=20")
+    parser.add_argument('--db-only', action='store_true', help="Insert the library directly into the database (no files; skips scan and serve_pdf)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="Skip the tracemalloc peak memory pass")
+    parser.add_argument('--seed', type=int, default=1234, help="Random seed for the synthetic library")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('--baseline', help="Compare against a previously saved JSON report")
+    parser.add_argument('--save-baseline', help="Also write the JSON report to this baseline file")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Regression threshold as a fraction (default 0.10)")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 if any metric regressed")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated scratch directory")
+    args = parser.parse_args(argv)
+
+    args.repeats = {}
+    for override in args.repeat:
+        name, _, count = override.partition('=')
+        if name not in PHASES or not count.isdigit():
+            parser.error(f"Invalid --repeat value '{override}'")
+        args.repeats[name] = int(count)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix='sheet_pro_bench_')
+    log(f"Scratch directory: {work_dir}")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+        },
+        'results': {},
+    }
+
+    try:
+        # The app prints diagnostics on most requests; keep them out of the report and the timings' way
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            sheet_app = import_app(work_dir)
+            for size_text in args.sizes:
+                item_count = parse_size(size_text)
+                report['results'][str(item_count)] = benchmark_size(sheet_app, item_count, args, work_dir)
+    finally:
+        if args.keep:
+            log(f"Kept scratch directory: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare_with_baseline(report, json.load(f), args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(output + '\n')
+
+    if report.get('comparison', {}).get('regressions'):
+        log(f"Regressions: {', '.join(report['comparison']['regressions'])}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())